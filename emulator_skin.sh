@@ -2,7 +2,7 @@
 
 function emulator_avd() {
 
-    avds=($(for f in `find ~/.android/avd/*.ini -iname *.ini`; do echo `basename $f .ini`; done))
+    avds=($(for f in ~/.android/avd/*.ini; do [ -f "$f" ] && basename "$f" .ini; done))
     select avd in ${avds[*]}
     do
         emulator -avd $avd -skindir "$1" -skin "$2" ${*:3}
@@ -10,25 +10,24 @@ function emulator_avd() {
     done
 }
 
-SKINDIR=`dirname "$1"`
-
 # Check for skin name argument
 if [ -z "$1" ]; then
     echo 
     echo "USAGE : $0 <skin_name> [emulator_args]"
     echo    
-    echo "<skin_name> is a subdirectory in $SKINDIR/"
+    echo "<skin_name> is a skin directory, a <skin_name>.skin archive, or the name of a skin listed by gimp-plugins/skin_catalog.py list"
     exit 1
 fi
 
-SKINNAME=`basename "$1"`
-SKINPATH=$SKINDIR/$SKINNAME
-
-# Check if skin directory is valid
-if ! [ -f "$SKINPATH/layout" ]; then
-    echo "emulator: ERROR: could not load skin '$SKINPATH'"
+# Skin directories and archives are validated by the skin catalog,
+# archives are unpacked to the cache, other names are searched in the catalog
+SKINPATH=`"$(dirname "$0")/gimp-plugins/skin_catalog.py" path "$1"`
+if [ $? -ne 0 ]; then
+    echo "emulator: ERROR: could not load skin '$1'"
     exit 2
 fi
+SKINDIR=`dirname "$SKINPATH"`
+SKINNAME=`basename "$SKINPATH"`
 
 echo
 echo Please select AVD to start with skin \"$SKINNAME\" : 
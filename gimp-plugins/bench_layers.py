@@ -0,0 +1,158 @@
+#! /usr/bin/env python
+""" Benchmarks of the pure python parts of the plugins, on synthetic skins built from fake layers.
+
+Results are written as json, to be compared between commits:
+
+USAGE : bench_layers.py [-o results.json] [--compare previous.json] [--sizes 10 100 ...]
+"""
+from __future__ import print_function
+
+import sys
+import json as _json
+import time
+import platform
+import argparse
+
+from gimp_fakes import FakeLayer, FakeGroup
+from gimp_layout import json, getlayers, find_layers, LayerIndex, dump_layout
+from skin_layout import skin_layout
+
+DEFAULT_SIZES = (10, 100, 1000, 10000)
+
+# Buttons are nested in groups this deep, every MASK_EVERY button has a mask
+NESTING_DEPTH = 8
+MASK_EVERY = 4
+
+# Each benchmark runs for at least MIN_TIME seconds, best of REPEAT runs is kept
+MIN_TIME = 0.05
+REPEAT = 5
+
+
+def fake_layer(name, width, height, x=0, y=0):
+    layer = FakeLayer(name, width, height)
+    layer.visible, layer.linked, layer.opacity, layer.mode = True, False, 100.0, 0
+    layer.offsets = [x, y]
+    layer.mask = None
+    return layer
+
+
+def fake_group(name, width, height, layers):
+    group = FakeGroup(name, width, height, False, layers)
+    group.visible, group.linked, group.opacity, group.mode = True, False, 100.0, 0
+    group.offsets = [0, 0]
+    group.mask = None
+    return group
+
+
+def fake_orientation(orientation, count, width, height):
+    """ Returns a portrait or landscape group of about count layers
+    """
+    suffix = orientation[:4]
+    layers = []
+    group = None
+    for i in range(count):
+        button = fake_layer('key%d_%s.png' % (i, suffix), 40, 40, i % width, i % height)
+        if i % MASK_EVERY == 0:
+            button.mask = fake_layer('key%d-mask_%s.png' % (i, suffix), 40, 40, i % width, i % height)
+        if i % NESTING_DEPTH == 0:
+            group = fake_group('group%d_%s' % (i, suffix), width, height, [])
+            layers.append(group)
+            parent = group
+        else:
+            sub_group = fake_group('group%d_%s' % (i, suffix), width, height, [])
+            parent.layers.append(sub_group)
+            parent = sub_group
+        parent.layers.append(button)
+    layers.append(fake_layer('screen_%s.png' % suffix, width - 200, height - 400, 100, 200))
+    layers.append(fake_layer('background_%s.png' % suffix, width, height))
+    return fake_group(orientation, width, height, layers)
+
+
+def fake_skin(size):
+    """ Returns a fake skin image of about size layers
+    """
+    count = max(1, size // 5)
+    return fake_group('Image', 1080, 1920, [
+        fake_layer('hardware.ini', 800, 1200),
+        fake_orientation('portrait', count, 1080, 1920),
+        fake_orientation('landscape', count, 1920, 1080),
+    ])
+
+
+class NullFile(object):
+    def write(self, data):
+        pass
+
+
+def measure(function):
+    """ Returns the best time of one call to function, in seconds
+    """
+    number = 1
+    while True:
+        start = time.time()
+        for _ in range(number):
+            function()
+        elapsed = time.time() - start
+        if elapsed >= MIN_TIME:
+            break
+        number *= 10
+    best = elapsed
+    for _ in range(REPEAT - 1):
+        start = time.time()
+        for _ in range(number):
+            function()
+        best = min(best, time.time() - start)
+    return best / number
+
+
+def benchmarks(image):
+    dumped = json.dumps(image)
+    loaded = json.loads(dumped)
+    return [
+        ('getlayers', lambda: sum(1 for _ in getlayers(image))),
+        ('find_layers', lambda: find_layers(image, '(?!(background|screen))')),
+        ('LayerIndex', lambda: LayerIndex(image)),
+        ('LayerIndex.find_layers', lambda index=LayerIndex(image):
+            index.find_layers('(?!(background|screen))')),
+        ('json.dumps', lambda: json.dumps(image)),
+        ('dump_layout', lambda: dump_layout(image, NullFile())),
+        ('json.loads', lambda: json.loads(dumped)),
+        ('skin_layout', lambda: skin_layout(image)),
+        ('skin_layout.loaded', lambda: skin_layout(loaded)),
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark layer traversal, json and layout')
+    parser.add_argument('-o', '--output', help='write results to this json file')
+    parser.add_argument('--compare', help='json results of a previous run to compare with')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='number of layers of the synthetic skins')
+    args = parser.parse_args(argv)
+
+    previous = {}
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            previous = _json.load(f)['results']
+
+    results = {}
+    for size in args.sizes:
+        image = fake_skin(size)
+        layer_count = sum(1 for _ in getlayers(image))
+        for name, function in benchmarks(image):
+            key = '%s/%d' % (name, size)
+            results[key] = measure(function)
+            line = '%-32s %6d layers %12.3f ms' % (key, layer_count, results[key] * 1000)
+            if key in previous:
+                line += '  x%.2f' % (results[key] / previous[key])
+            print(line)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            _json.dump({'python': platform.python_version(), 'results': results},
+                       f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
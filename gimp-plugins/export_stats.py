@@ -0,0 +1,154 @@
+""" Timing and resource statistics of layout and skin exports
+
+Set SKIN_EXPORT_STATS=1 to write layout.stats.json next to layout.json,
+SKIN_EXPORT_STATS=print to also print a summary.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+import json
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+STATS_ENV = 'SKIN_EXPORT_STATS'
+STATS_FILE = 'layout.stats.json'
+
+# Slowest layers listed in the printed summary
+SUMMARY_LAYERS = 5
+
+
+def stats_mode():
+    """ Returns None when statistics are disabled, 'write' or 'print' otherwise
+    """
+    mode = os.environ.get(STATS_ENV, '').lower()
+    if mode in ('', '0', 'no', 'false'):
+        return None
+    return mode == 'print' and 'print' or 'write'
+
+
+def peak_rss():
+    """ Returns peak resident memory of this process in bytes, None if unknown
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on Mac OS
+    return sys.platform == 'darwin' and rss or rss * 1024
+
+
+def gimp_peak_rss():
+    """ Returns peak resident memory of Gimp in bytes, None if unknown.
+    Plugins run in their own process, image data lives in the parent Gimp process
+    """
+    try:
+        with open('/proc/%d/status' % os.getppid(), 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+class ExportStats(object):
+    """ Wall time, peak memory and bytes written of export stages and layers
+    """
+
+    def __init__(self, name=''):
+        self.name = name
+        self.stages = []
+        self.layers = []
+        self._stage = None
+
+    @contextmanager
+    def stage(self, name):
+        stage = OrderedDict([('name', name), ('time', 0.0), ('bytes_written', 0)])
+        parent, self._stage = self._stage, stage
+        start = time.time()
+        try:
+            yield stage
+        finally:
+            stage['time'] = time.time() - start
+            stage['peak_rss'] = peak_rss()
+            stage['gimp_peak_rss'] = gimp_peak_rss()
+            self.stages.append(stage)
+            self._stage = parent
+            if parent is not None:
+                parent['bytes_written'] += stage['bytes_written']
+
+    @contextmanager
+    def layer(self, name, filepath=None):
+        """ Time the export of a layer, counting bytes of filepath as written when it changes
+        """
+        layer = OrderedDict([('name', name),
+                             ('stage', self._stage and self._stage['name']),
+                             ('time', 0.0), ('bytes_written', 0)])
+        before = _file_signature(filepath)
+        start = time.time()
+        try:
+            yield layer
+        finally:
+            layer['time'] = time.time() - start
+            after = _file_signature(filepath)
+            if after and after != before:
+                layer['bytes_written'] = after[0]
+                if self._stage is not None:
+                    self._stage['bytes_written'] += after[0]
+            self.layers.append(layer)
+
+    def as_dict(self):
+        return OrderedDict([('name', self.name),
+                            ('time', sum(s['time'] for s in self.stages)),
+                            ('peak_rss', peak_rss()),
+                            ('gimp_peak_rss', gimp_peak_rss()),
+                            ('stages', self.stages),
+                            ('layers', self.layers)])
+
+    def save(self, save_path):
+        """ Write the report to save_path when statistics are enabled, print it if asked
+        """
+        mode = stats_mode()
+        if not mode:
+            return
+        if not os.path.isdir(save_path):
+            os.makedirs(save_path)
+        with open(os.path.join(save_path, STATS_FILE), 'w') as f:
+            json.dump(self.as_dict(), f, indent=2)
+        if mode == 'print':
+            print(self.summary())
+
+    def summary(self):
+        lines = ['EXPORT STATS: %s' % self.name]
+        for stage in self.stages:
+            lines.append('  %-24s %8.2fs %10s written, rss %s, gimp rss %s' % (
+                stage['name'], stage['time'], _size(stage['bytes_written']),
+                _size(stage['peak_rss']), _size(stage['gimp_peak_rss'])))
+        for layer in sorted(self.layers, key=lambda l: -l['time'])[:SUMMARY_LAYERS]:
+            lines.append('  %-40s %8.2fs %10s written  (%s)' % (
+                layer['name'], layer['time'], _size(layer['bytes_written']), layer['stage']))
+        return '\n'.join(lines)
+
+
+def _file_signature(filepath):
+    try:
+        st = os.stat(filepath)
+        return st.st_size, st.st_mtime, st.st_ino
+    except (OSError, TypeError):
+        return None
+
+
+def _size(size):
+    if size is None:
+        return '?'
+    for unit in ('B', 'kB', 'MB'):
+        if size < 1024:
+            return '%d %s' % (size, unit)
+        size /= 1024.0
+    return '%.1f GB' % size
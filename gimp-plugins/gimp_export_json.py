@@ -1,121 +1,160 @@
 #! /usr/bin/env python
 
-import re
 import os
-import functools
-import json as _json
+import hashlib
+from multiprocessing.pool import ThreadPool
 
 from collections import namedtuple
 from collections import OrderedDict
 import mimetypes
 mimetypes.add_type('text/plain', '.ini')
 
-gimp_required_fields = ('name', 'width', 'height')
-gimp_extra_fields = ('visible', 'linked', 'opacity', 'mode', 'offsets', 'mask', 'layers')
-
-JSON_LAYOUT_FILE = 'layout.json'
-
-
-def owned_attrs(o, *fields):
-    return [f for f in fields if hasattr(o, f)]
-
-
-def hasattrs(o, *fields):
-    return len(owned_attrs(o, *fields)) == len(fields)
-
-
-def getattrs(o, *fields):
-    return [(f, getattr(o, f)) for f in fields]
-
-
-def as_ordered_dict(obj, required_attrs, extra_attrs):
-    object_attrs = list(required_attrs)
-
-    if hasattrs(obj, *required_attrs):
-        object_attrs.extend(owned_attrs(obj, *extra_attrs))
-        return OrderedDict(getattrs(obj, *object_attrs))
-
-
-def _json_object_hook(d):
-    return namedtuple('GimpObject', d.keys())(*d.values())
-
-
-class GimpJSONEncoder(_json.JSONEncoder):
-    def default(self, obj):
-        return as_ordered_dict(obj, gimp_required_fields, gimp_extra_fields) or \
-            _json.JSONEncoder.default(self, obj)
-
-
-# Customize my json
-json = namedtuple('GimpJson', 'load loads dump dumps')(
-        load=functools.partial(_json.load, object_hook=_json_object_hook),
-        loads=functools.partial(_json.loads, object_hook=_json_object_hook),
-        dump=functools.partial(_json.dump, cls=GimpJSONEncoder, indent=2),
-        dumps=functools.partial(_json.dumps, cls=GimpJSONEncoder, indent=2),
+from gimp_layout import gimp_required_fields, gimp_extra_fields, JSON_LAYOUT_FILE
+from gimp_layout import gimp_import_manifest, gimp_export_manifest, unlink_shared
+from gimp_layout import as_ordered_dict, json, getlayers, LayerIndex, MASK_FORMAT
+from gimp_layout import dump_layout
+from export_stats import ExportStats
+from png_encode import PNG_COLOR_TYPES, PNG_COLOR_GRAY, DEFAULT_PNG_PROFILE
+from png_encode import png_profile, indexed_to_rgba, write_png
+
+# Gimp tiles are 64x64, layer pixels are read one strip of tiles at a time
+TILE_HEIGHT = 64
+
+# Layer files are read ahead of Gimp by a few threads during import
+PREFETCH_THREADS = 4
+PREFETCH_BUFFER_SIZE = 1 << 20
+
+# see pdb.file_png_save & pdb.file_png_save2 for png export options
+PNG_SAVE_OPTIONS = (
+    0,  # 0 'interlace PDB_INT32: Use Adam7 interlacing?'
+    9,  # 9 'compression PDB_INT32: Deflate Compression factor (0--9)'
+    1,  # 1 'bkgd PDB_INT32: Write bKGD chunk?' Save background color
+    0,  # 0 'gama PDB_INT32: Write gAMA chunk?' Save Gamma
+    0,  # 0 'offs PDB_INT32: Write oFFs chunk?' Sale layer offset
+    1,  # 1 'phys PDB_INT32: Write pHYs chunk?' Save resolution
+    # 0 to not alter png file content
+    0,  # 1 'time PDB_INT32: Write tIME chunk?' Save creation time
+    1,  # 1 'comment PDB_INT32: Write comment?' Save comment
+    1,  # 1 'svtrans PDB_INT32: Preserve color of transparent pixels?'
 )
 
 
-def getlayers(group):
-    """ Returns a generator of layers and sub-layers
-    result is a tuple (parent,layer)
-    """
-    for layer in group.layers:
-        yield group, layer
-        if hasattr(layer, 'mask'):
-            if layer.mask:
-                yield layer, layer.mask
-        if hasattr(layer, 'layers'):
-            for g, l in getlayers(layer):
-                yield g, l
+def gimp_autocrop_layer(image, layer):
+    pdb.gimp_image_set_active_layer(image, layer)
+    pdb.plug_in_autocrop_layer(image, layer)
 
 
-def find_layers(group, name):
-    return [l for p, l in getlayers(group) if re.match(name, l.name)]
+def gimp_layer_hash(layer, export_params):
+    """ Returns a digest of layer content and of the parameters used to export it
+    """
+    h = hashlib.sha1(repr(export_params))
+    h.update(repr((layer.width, layer.height)))
+    if pdb.gimp_item_is_text_layer(layer):
+        h.update(pdb.gimp_text_layer_get_text(layer))
+    else:
+        h.update(repr(layer.bpp))
+        pixels = layer.get_pixel_rgn(0, 0, layer.width, layer.height, False, False)
+        for y in range(0, layer.height, TILE_HEIGHT):
+            h.update(pixels[0:layer.width, y:min(y + TILE_HEIGHT, layer.height)])
+    return h.hexdigest()
+
+
+def gimp_drawable_rows(drawable):
+    """ Yields rows of drawable pixels, read one strip of tiles at a time
+    """
+    pixels = drawable.get_pixel_rgn(0, 0, drawable.width, drawable.height, False, False)
+    row_size = drawable.width * drawable.bpp
+    for y in range(0, drawable.height, TILE_HEIGHT):
+        strip = pixels[0:drawable.width, y:min(y + TILE_HEIGHT, drawable.height)]
+        for i in range(0, len(strip), row_size):
+            yield strip[i:i + row_size]
 
 
-def find_layer(group, name):
-    layers = find_layers(group, name)
-    return layers and layers[0] or None
+def gimp_save_png(image, drawable, filepath, profile):
+    """ Save drawable to a png file with a png_encode profile, pixels are read in this
+    thread and deflated by the threads of png_encode
+    """
+    rows = gimp_drawable_rows(drawable)
+    palette = None
+    if pdb.gimp_item_is_channel(drawable):
+        color_type = PNG_COLOR_GRAY
+    else:
+        color_type = PNG_COLOR_TYPES[drawable.type]
+        if drawable.type in (gimpfu.INDEXED_IMAGE, gimpfu.INDEXEDA_IMAGE):
+            colormap = ''.join(chr(c) for c in pdb.gimp_image_get_colormap(image)[1])
+            if drawable.type == gimpfu.INDEXEDA_IMAGE:
+                rows = indexed_to_rgba(rows, colormap)
+            else:
+                palette = colormap
+    comment = image.parasite_find('gimp-comment')
+    write_png(filepath, drawable.width, drawable.height, color_type, rows, palette,
+              pdb.gimp_image_get_resolution(image),
+              comment and comment.data.rstrip('\0').decode('utf-8'), profile)
 
 
-def gimp_autocrop_layer(image, layer):
-    pdb.gimp_image_set_active_layer(image, layer)
-    pdb.plug_in_autocrop_layer(image, layer)
+def _is_exported(filepath, entry, layer_hash):
+    return entry and entry['hash'] == layer_hash and \
+        os.path.isfile(filepath) and os.path.getsize(filepath) == entry['size']
 
 
-def gimp_export_pngs(image, save_path):
+def gimp_export_pngs(image, save_path, stats=None):
+    """ Export layers to save_path, skipping layers unchanged since last export.
+    Files of layers exported previously that no longer exist are removed.
+    """
+    stats = stats or ExportStats()
     if not os.path.isdir(save_path):
         os.makedirs(save_path)
 
-    for parent, layer in getlayers(image):
-        print 'PNG EXPORT: %s/%s' % (parent.name, layer.name)
-        if hasattr(layer, 'layers'):
-            # Ignore GroupLayers
-            pass
-        else:
-            # Also export text layers to text files
-            if pdb.gimp_item_is_text_layer(layer):
-                with open(os.path.join(save_path, layer.name), 'w') as f:
-                    f.write(pdb.gimp_text_layer_get_text(layer))
-            else:
-                png_filepath = os.path.join(save_path, layer.name)
-                # see pdb.file_png_save & pdb.file_png_save2 for png export options
-                pdb.file_png_save2(image, layer, png_filepath, png_filepath,
-                                   0,  # 0 'interlace PDB_INT32: Use Adam7 interlacing?'
-                                   9,
-                                   # 9 'compression PDB_INT32: Deflate Compression factor (0--9)'
-                                   1,  # 1 'bkgd PDB_INT32: Write bKGD chunk?' Save background color
-                                   0,  # 0 'gama PDB_INT32: Write gAMA chunk?' Save Gamma
-                                   0,  # 0 'offs PDB_INT32: Write oFFs chunk?' Sale layer offset
-                                   1,  # 1 'phys PDB_INT32: Write pHYs chunk?' Save resolution
-
-                                   # 0 to not alter png file content
-                                   0,  # 1 'time PDB_INT32: Write tIME chunk?' Save creation time
-
-                                   1,  # 1 'comment PDB_INT32: Write comment?' Save comment
-                                   1,
-                                   # 1 'svtrans PDB_INT32: Preserve color of transparent pixels?'
-                                   )
+    profile = png_profile()
+    export_params = (PNG_SAVE_OPTIONS,
+                     pdb.gimp_image_get_resolution(image),
+                     str(pdb.gimp_context_get_background()))
+    if profile != DEFAULT_PNG_PROFILE:
+        export_params += (profile,)
+    manifest = gimp_import_manifest(save_path)
+    exported = {}
+    try:
+        for parent, layer in getlayers(image):
+            if hasattr(layer, 'layers'):
+                # Ignore GroupLayers
+                continue
+
+            filepath = os.path.join(save_path, layer.name)
+            is_mask = bool(getattr(parent, 'mask', None)) and parent.mask.ID == layer.ID
+            with stats.layer(layer.name, filepath) as layer_stats:
+                layer_hash = gimp_layer_hash(layer, is_mask and export_params + (MASK_FORMAT,)
+                                             or export_params)
+                layer_stats['unchanged'] = _is_exported(filepath, manifest.get(layer.name),
+                                                        layer_hash)
+                if layer_stats['unchanged']:
+                    print 'PNG UNCHANGED: %s/%s' % (parent.name, layer.name)
+                else:
+                    print 'PNG EXPORT: %s/%s' % (parent.name, layer.name)
+                    unlink_shared(filepath)
+                    # Also export text layers to text files
+                    if pdb.gimp_item_is_text_layer(layer):
+                        with open(filepath, 'w') as f:
+                            f.write(pdb.gimp_text_layer_get_text(layer))
+                    elif is_mask:
+                        # Mask pixels, as they are
+                        gimp_save_png(image, layer, filepath, profile)
+                    elif profile == DEFAULT_PNG_PROFILE:
+                        pdb.file_png_save2(image, layer, filepath, filepath, *PNG_SAVE_OPTIONS)
+                    else:
+                        gimp_save_png(image, layer, filepath, profile)
+            exported[layer.name] = dict(hash=layer_hash, size=os.path.getsize(filepath))
+    except Exception:
+        # Layers not reached keep their entry from the previous export
+        manifest.update(exported)
+        gimp_export_manifest(save_path, manifest)
+        raise
+
+    for name in set(manifest) - set(exported):
+        filepath = os.path.join(save_path, name)
+        if os.path.isfile(filepath):
+            print 'PNG REMOVE: %s' % name
+            os.remove(filepath)
+    gimp_export_manifest(save_path, exported)
 
 
 def gimp_export_json(image, file_path):
@@ -123,7 +162,7 @@ def gimp_export_json(image, file_path):
         os.makedirs(file_path)
     file_path = os.path.join(file_path, JSON_LAYOUT_FILE)
     with open(file_path, 'w') as f:
-        json.dump(image, f)
+        dump_layout(image, f)
 
 
 def gimp_import_json(file_path):
@@ -148,31 +187,79 @@ def gimp_import_pngs(image_obj, import_path):
         display = pdb.gimp_display_new(gimp_image)
 
 
+def _prefetch_layer_file(filepath):
+    """ Returns the kind of a layer file: None, 'text' or 'image', and the text of text files.
+    Image files are read through so that gimp_file_load_layer finds them in the page cache
+    """
+    if not filepath or not os.path.isfile(filepath):
+        return None, None
+    mimetype = mimetypes.guess_type(filepath)[0]
+    if mimetype and mimetype.startswith('text'):
+        with open(filepath, 'r') as f:
+            return 'text', f.read()
+    with open(filepath, 'rb') as f:
+        while f.read(PREFETCH_BUFFER_SIZE):
+            pass
+    return 'image', None
+
+
 def _gimp_file_import_layers(layers, image, import_path):
     """Import layers into the image, reading pictures from import_path+"/"+layer.name
+    Files are read ahead by a pool of threads, Gimp calls are all made from this thread
     """
-    for source_parent, source_layer in layers:
+    layers = list(layers)
+    filepaths = [not hasattr(l, 'layers') and os.path.join(import_path, l.name) or None
+                 for p, l in layers]
+    pool = ThreadPool(PREFETCH_THREADS)
+    try:
+        prefetched = pool.imap(_prefetch_layer_file, filepaths)
+        _gimp_insert_layers(layers, prefetched, filepaths, image)
+    finally:
+        pool.terminate()
+
+
+def gimp_import_mask(layer, filepath):
+    """ Add the mask of layer from a gray png file, its pixels are copied as they are
+    """
+    mask_image = pdb.file_png_load(filepath, filepath)
+    try:
+        source = mask_image.layers[0]
+        if source.bpp != 1:
+            raise ValueError('%s is not a %s mask file' % (filepath, MASK_FORMAT))
+        mask = pdb.gimp_layer_create_mask(layer, gimpfu.ADD_WHITE_MASK)
+        pdb.gimp_layer_add_mask(layer, mask)
+        width, height = min(mask.width, source.width), min(mask.height, source.height)
+        pixels = mask.get_pixel_rgn(0, 0, width, height, True, False)
+        pixels[0:width, 0:height] = \
+            source.get_pixel_rgn(0, 0, width, height, False, False)[0:width, 0:height]
+        mask.flush()
+        mask.update(0, 0, width, height)
+    finally:
+        pdb.gimp_image_delete(mask_image)
+
+
+def _gimp_insert_layers(layers, prefetched, filepaths, image):
+    index = LayerIndex(image)
+    for (source_parent, source_layer), filepath in zip(layers, filepaths):
         print 'PNG IMPORT: %s/%s' % (source_parent.name, source_layer.name)
-        parent = find_layer(image, '^%s$' % source_parent.name)
+        kind, text = next(prefetched)
+        parent = index.get(source_parent.name)
+        is_mask = hasattr(source_parent, 'mask') and source_layer == source_parent.mask
+        if is_mask and getattr(source_layer, 'format', None) == MASK_FORMAT:
+            if kind == 'image':
+                gimp_import_mask(parent, filepath)
+            continue
         if hasattr(source_layer, 'layers'):
             # Create GroupLayer
             layer = pdb.gimp_layer_group_new(image)
+        elif kind == 'text':
+            # Import text Layer
+            layer = pdb.gimp_text_layer_new(image, text, 'Monospace', 24, 0)
+        elif kind == 'image':
+            # Import image Layer
+            layer = pdb.gimp_file_load_layer(image, filepath)
         else:
-            # Read file from disk & create new Layer
-            image_filepath = os.path.join(import_path, source_layer.name)
-            name, ext = os.path.splitext(image_filepath)
-            if os.path.isfile(image_filepath):
-                mimetype = mimetypes.guess_type(image_filepath)[0]
-                if mimetype and mimetype.startswith('text'):
-                    # Import text Layer
-                    with open(image_filepath, 'r') as f:
-                        text = f.read()
-                    layer = pdb.gimp_text_layer_new(image, text, 'Monospace', 24, 0)
-                else:
-                    # Import image Layer
-                    layer = pdb.gimp_file_load_layer(image, image_filepath)
-            else:
-                layer = None
+            layer = None
 
         if layer:
             # Set layer attributes
@@ -184,8 +271,8 @@ def _gimp_file_import_layers(layers, image, import_path):
             hasattr(source_layer, 'opacity') and pdb.gimp_layer_set_opacity(layer,
                                                                             source_layer.opacity)
             hasattr(source_layer, 'mode') and pdb.gimp_layer_set_mode(layer, source_layer.mode)
-            if hasattr(source_parent, 'mask') and source_layer == source_parent.mask:
-                # Insert Layer into the Image
+            if is_mask:
+                # Masks without format: insert Layer into the Image
                 pdb.gimp_image_insert_layer(image, layer, None, 0)
                 # Apply Layer mask
                 pdb.gimp_layer_add_alpha(layer)
@@ -201,40 +288,74 @@ def _gimp_file_import_layers(layers, image, import_path):
                 # Insert Layer into the Image
                 pdb.gimp_image_insert_layer(image, layer, parent,
                                             parent and len(parent.layers) or len(image.layers))
+                index.insert(layer, parent)
 
             # Set Text Layer size
             if layer and pdb.gimp_item_is_text_layer(layer):
                 pdb.gimp_text_layer_resize(layer, source_layer.width, source_layer.height)
 
 
-def create_copy(image, only_visible=False, crop_visible=False, crop_linked=False):
+def gimp_prepare_layers(image, only_visible=False, crop_visible=False, crop_linked=False,
+                        stats=None):
+    """ Remove hidden layers and autocrop visible or linked layers of image, in place.
+    Only exported layers are cropped: groups, masks and layers of removed groups are not
+    """
+    stats = stats or ExportStats()
     delete_layers = []
-    image_copy = pdb.gimp_image_duplicate(image)
-    pdb.gimp_image_undo_disable(image_copy)
-    pdb.gimp_image_set_filename(image_copy, image.name)
-    for parent, layer in getlayers(image_copy):
-        if only_visible and not layer.visible:
-            delete_layers.append(layer)
-            continue
-        if crop_visible and layer.visible:
-            gimp_autocrop_layer(image_copy, layer)
-        elif crop_linked and layer.linked:
-            gimp_autocrop_layer(image_copy, layer)
+    removed = set()
+    with stats.stage('autocrop'):
+        for parent, layer in getlayers(image):
+            if parent.ID in removed:
+                # Removed with its group
+                removed.add(layer.ID)
+                continue
+            if getattr(parent, 'mask', None) and parent.mask.ID == layer.ID:
+                # Masks follow their layer
+                continue
+            if only_visible and not layer.visible:
+                delete_layers.append(layer)
+                removed.add(layer.ID)
+                continue
+            if hasattr(layer, 'layers'):
+                continue
+            if (crop_visible and layer.visible) or (crop_linked and layer.linked):
+                with stats.layer(layer.name):
+                    gimp_autocrop_layer(image, layer)
 
     for l in delete_layers:
-        pdb.gimp_image_remove_layer(image_copy, l)
+        pdb.gimp_image_remove_layer(image, l)
 
+
+def create_copy(image, only_visible=False, crop_visible=False, crop_linked=False, stats=None):
+    stats = stats or ExportStats()
+    with stats.stage('duplicate'):
+        image_copy = pdb.gimp_image_duplicate(image)
+        pdb.gimp_image_undo_disable(image_copy)
+        pdb.gimp_image_set_filename(image_copy, image.name)
+    gimp_prepare_layers(image_copy, only_visible, crop_visible, crop_linked, stats)
     return image_copy
 
 
+def gimp_export_image(image, save_path, stats=None):
+    """ Export layout.json and layers of image, as they are, to save_path
+    """
+    stats = stats or ExportStats()
+    with stats.stage('json'), \
+            stats.layer(JSON_LAYOUT_FILE, os.path.join(save_path, JSON_LAYOUT_FILE)):
+        gimp_export_json(image, save_path)
+    with stats.stage('png'):
+        gimp_export_pngs(image, save_path, stats)
+
+
 def gimp_export(image, layout, save_path, only_visible=False, crop_visible=False,
                 crop_linked=False):
-    img = create_copy(image, only_visible, crop_visible, crop_linked)
+    stats = ExportStats(image.name)
+    img = create_copy(image, only_visible, crop_visible, crop_linked, stats)
     try:
-        gimp_export_json(img, save_path)
-        gimp_export_pngs(img, save_path)
+        gimp_export_image(img, save_path, stats)
     finally:
         pdb.gimp_image_delete(img)
+    stats.save(save_path)
 
 
 def gimp_import(load_path):
@@ -245,7 +366,12 @@ def gimp_import(load_path):
 try:
     import gimpfu
     from gimpfu import pdb
+except ImportError:
+    gimpfu, pdb = None, None
+    print('Imported as a module \n')
 
+# Procedures are registered when Gimp runs this plugin, not when other plugins import it
+if gimpfu and __name__ == '__main__':
     DEFAULT_OUTPUT_DIR = os.getcwd()
 
     gimpfu.register("python_fu_layout_export",
@@ -286,26 +412,9 @@ try:
 
     gimpfu.main()
 
-except ImportError:
-    gimpfu, pdb = None, None
-    print('Imported as a module \n')
-
-if __name__ == '__main__':
+elif __name__ == '__main__':
     # Tests
-
-    # Fake Gimp Layer
-    class FakeLayer(object):
-        def __init__(self, name, width, height):
-            self.name = name
-            self.width = width
-            self.height = height
-
-    # Fake Gimp Layer Group
-    class FakeGroup(FakeLayer):
-        def __init__(self, name, width, height, unsupported, layers):
-            super(FakeGroup, self).__init__(name, width, height)
-            self.unsupported = unsupported
-            self.layers = layers
+    from gimp_fakes import FakeLayer, FakeGroup
 
     assert as_ordered_dict(
             FakeLayer('n', 'w', 'h'), gimp_required_fields, gimp_extra_fields) == \
@@ -337,3 +446,25 @@ GimpObject(width=80, name=u'layer_A1', height=60), \
 GimpObject(width=80, name=u'Layer_A2', height=60)], \
 width=80, name=u'group_A', height=60)], \
 width=80, name=u'Image', height=60)"""
+
+    # Masks are flagged with the format of their files
+    masked = FakeLayer("masked", 80, 60)
+    masked.mask = FakeLayer("masked mask", 80, 60)
+    mask = json.loads(json.dumps(FakeGroup("Image", 80, 60, False, [masked]))).layers[0].mask
+    assert mask.name == "masked mask" and mask.format == MASK_FORMAT
+
+    # Objects with the same fields share one record type
+    layers = json.loads(json.dumps(im)).layers
+    assert type(layers[0]) is type(layers[1]) is type(layers[2].layers[0])
+    assert type(layers[0]) is not type(layers[2])
+
+    # The streaming writer writes what json.dump writes
+    from StringIO import StringIO
+    for obj in (im, FakeGroup("Image", 80, 60, False, [masked]), json.loads(json.dumps(im))):
+        f = StringIO()
+        dump_layout(obj, f)
+        assert f.getvalue() == json.dumps(obj), f.getvalue()
+
+    # Pixel regions of indexed layers are read as str
+    assert list(indexed_to_rgba([b'\x01\x80\x00\xff'], b'\x00\x00\x00\x0a\x0b\x0c')) == \
+        [bytearray(b'\x0a\x0b\x0c\x80\x00\x00\x00\xff')]
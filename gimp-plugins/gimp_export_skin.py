@@ -4,212 +4,71 @@ import re
 import sys
 import os
 import json
+import time
+import traceback
 from pipes import quote
-from string import Template
 from collections import namedtuple
 from collections import OrderedDict
 import mimetypes
 mimetypes.add_type('text/plain','.ini')
 
-DENSITIES = (
-    # name, (density, min, max)
-    ('DEFAULT',(0,0,0)),
-    ('ldpi',(120,120,139)),
-    ('mdpi',(160,140,199)),
-    ('hdpi',(240,200,279)),
-    ('xhdpi',(320,280,399)),
-    ('xxhdpi',(480,400,559)),
-    ('xxxhdpi',(640,560,719))
-    )
-DENSITIES_MAP = dict(DENSITIES)
-SKIN_RATIOS = ('DEFAULT', '4/3', '16/9')
-
-LAYOUT = Template("""
-parts {
-   device {
-        display {
-            width   ${screen_port_width}
-            height  ${screen_port_height}
-            x       0
-            y       0
-        }
-    }
-    
-    portrait {
-        background {
-            image   background_port.png
-        }
-
-        buttons {
-            ${buttons_port}
-        }
-    }
-    
-    landscape {
-        background {
-            image   background_land.png
-        }
-
-        buttons {
-            ${buttons_land}
-        }
-    }
-}
-
-layouts {
-    portrait {
-        width     ${background_port_width}
-        height    ${background_port_height} 
-        color     0x555555
-        
-        part1 {
-            name    portrait
-            x       0
-            y       0
-        }
-
-        part2 {
-            name    device
-            x       $screen_port_x
-            y       $screen_port_y
-        }
-    }
-    
-    landscape {
-        width     ${background_land_width}
-        height    ${background_land_height}
-        color     0x555555
-        
-        part1 {
-            name    landscape
-            x       0
-            y       0
-        }
-
-        part2 {
-            name   device
-            x      $screen_land_x
-            y      $screen_land_y
-            rotation 3
-        }
-    }
-}
-
-""")
-
-BUTTON = Template("""
-            ${button_name} {
-                image   ${button_name}_${orientation}.png
-                x       ${button_x}
-                y       ${button_y}
-            }""")
-
-class LayerNameError(Exception):
-    pass
-
-def getlayers(group):
-    """ Returns a generator of layers and sub-layers
-    result is a tuple (parent,layer)
-    """
-    for layer in group.layers:
-        yield group, layer
-        if hasattr(layer, 'mask'):
-                if layer.mask: yield layer,layer.mask
-        if hasattr(layer,'layers'):
-            for g,l in getlayers(layer):
-                yield g,l
-
-def find_layers(group, name):
-    return [l for p,l in getlayers(group) if re.match(name, l.name)]
-
-def find_layer(group, name):
-    layers = find_layers(group, name)
-    return layers and layers[0] or None
-
-def skin_export_layout(image, save_path):
-
-    port_layers = find_layer(image, 'portrait')
-    land_layers = find_layer(image, 'landscape')
-    screen_port = find_layer(port_layers, 'screen_port.png')
-    screen_land = find_layer(land_layers, 'screen_land.png')
-    background_port = find_layer(port_layers, 'background_port.png')
-    background_land = find_layer(land_layers, 'background_land.png')
-
-    skin_layout = {}
-    skin_layout['screen_port_width']=screen_port.width
-    skin_layout['screen_port_height']=screen_port.height
-
-    skin_layout['background_port_width']  = background_port.width
-    skin_layout['background_port_height'] = background_port.height
-    skin_layout['background_land_width']  = background_land.width
-    skin_layout['background_land_height'] = background_land.height
-    
-    skin_layout['screen_port_x'] = screen_port.offsets[0] - background_port.offsets[0]
-    skin_layout['screen_port_y'] = screen_port.offsets[1] - background_port.offsets[1]
-    skin_layout['screen_land_x'] = screen_land.offsets[0] - background_land.offsets[0]
-    skin_layout['screen_land_y'] = screen_land.offsets[1] - background_land.offsets[1] + screen_land.height
-
-    fullname_parser = re.compile('^(.*)_(\w*)\.?.*$')
-    
-    button_layers = find_layers(port_layers, '(?!(background|screen))') + find_layers(land_layers, '(?!(background|screen))')
+from gimp_layout import getlayers, find_layers, find_layer, LayerIndex, MASK_FORMAT
+from skin_layout import LayerNameError, SKIN_LAYOUT_FILE, SKIN_STAMP_FILE, skin_export_layout
+from skin_layout import DENSITIES, DENSITIES_MAP, SKIN_RATIOS, density_scale
+from export_stats import ExportStats
+from png_encode import png_profile
+from gimp_export_json import gimp_prepare_layers, gimp_export_image
 
-    buttons = dict(land = [],port = [])
+DENSITY_NAMES = ' '.join(d[0] for d in DENSITIES[1:])
 
-    for layer in button_layers:
-        try:
-            button_name, orientation = fullname_parser.findall(layer.name)[0]
-            orientation = orientation[:4].lower()
-            background_layer = orientation == 'port' and background_port or background_land
-            buttons[orientation].append(BUTTON.substitute({
-                'button_name':button_name,
-                'orientation':orientation,
-                'button_x': layer.offsets[0] - background_layer.offsets[0],
-                'button_y': layer.offsets[1] - background_layer.offsets[1]}))
-        except e:
-            raise LayerNameError(e, """Cannot identify button layer with name: \n"%s"\n\nName must be like: "<button_key>_port.png" or "<button_key>_land.png".\n\n""" % layer.name)
-    
-    skin_layout['buttons_port'] = ''.join(buttons['port'])
-    skin_layout['buttons_land'] = ''.join(buttons['land'])
-    
-    layout_filepath = os.path.join(save_path, 'layout')
-    with open(layout_filepath, 'w') as f:
-        f.write(LAYOUT.substitute(skin_layout))
+# Version of exported files, skins exported by an older version are exported again
+SKIN_EXPORT_VERSION = 2
+# Set to export skins again, even when unchanged since their last export
+SKIN_FORCE_ENV = 'XCF_FORCE'
 
-def skin_scale(image, target_density):
-    hardware_layer = find_layer(image,'hardware.ini')
+def skin_scale(image, target_density, index=None):
+    index = index or LayerIndex(image)
+    hardware_layer = index.find_layer('hardware.ini')
     hardware_config = pdb.gimp_text_layer_get_text(hardware_layer)
+    index.rename(hardware_layer, 'old_hardware.ini')
     hardware_layer.name = 'old_hardware.ini'
-    skin_density = int(re.findall('hw.lcd.density\W*=\W*(\d*).*', hardware_config)[0])
-    ref_skin_density = [d[1][0] for d in DENSITIES_MAP.iteritems() if skin_density in range(d[1][1],d[1][2])][0]
-    target_density_value = DENSITIES_MAP.get(target_density)[0]
-    scale = float(target_density_value) / ref_skin_density
+    scale, hardware_config_scaled = density_scale(hardware_config, target_density)
     pdb.gimp_image_scale(image, round(scale*image.width), round(scale*image.height))
-    hardware_config_scaled = re.sub('(.*hw.lcd.density\W*=\W*)(\d*)(.*)', '\\g<1>%d\\g<3>' % int(scale * skin_density), hardware_config)
     hardware_layer_copy = pdb.gimp_text_layer_new(image, hardware_config, 'Monospace', 24, 0)
-    pdb.gimp_image_insert_layer(image, hardware_layer_copy, None, pdb.gimp_image_get_item_position(image,hardware_layer))
+    position = pdb.gimp_image_get_item_position(image,hardware_layer)
+    pdb.gimp_image_insert_layer(image, hardware_layer_copy, None, position)
     pdb.gimp_item_set_name(hardware_layer_copy, 'hardware.ini')
+    index.insert(hardware_layer_copy, None, position)
     pdb.gimp_layer_set_offsets(hardware_layer_copy, *hardware_layer.offsets)
     pdb.gimp_text_layer_resize(hardware_layer_copy, hardware_layer.width, hardware_layer.height)
     pdb.gimp_text_layer_set_text(hardware_layer_copy, hardware_config_scaled)
+    index.remove(hardware_layer)
     pdb.gimp_image_remove_layer(image,hardware_layer)
 
-def skin_rotate_group(image, layer, direction):
+def skin_rotate_group(image, layer, direction, index=None):
+    index = index or LayerIndex(image)
     rotation = {'portrait':ROTATE_270,'landscape':ROTATE_90}
     angle = rotation[direction[0]]
     
     old_layer = pdb.gimp_image_get_layer_by_name(image, direction[1])
-    pdb.gimp_image_remove_layer(image,old_layer) if old_layer else None
+    if old_layer:
+        index.remove(old_layer)
+        pdb.gimp_image_remove_layer(image,old_layer)
 
     new_layer = pdb.gimp_layer_copy(layer, True)
     pdb.gimp_item_set_visible(new_layer, False)
-    pdb.gimp_image_insert_layer(image, new_layer, None, pdb.gimp_image_get_item_position(image,layer)+1)
+    position = pdb.gimp_image_get_item_position(image,layer)+1
+    pdb.gimp_image_insert_layer(image, new_layer, None, position)
     pdb.gimp_item_transform_rotate_simple(new_layer, angle, False, image.width/2, image.height/2)
     new_layer.name = layer.name.replace(*direction)
 
     #Retrieve new_layer as a LayerGroup
-    new_layer = find_layer(image,new_layer.name)
+    new_layer = [l for l in image.layers if l.name == new_layer.name][0]
+    index.insert(new_layer, None, position)
     for l in new_layer.layers:
-        l.name = re.sub('(.*)(_%s)(\.\w*) ?#?.*' % direction[0][:4], '\\1_%s\\3' % direction[1][:4], l.name)
+        name = re.sub('(.*)(_%s)(\.\w*) ?#?.*' % direction[0][:4], '\\1_%s\\3' % direction[1][:4], l.name)
+        index.rename(l, name)
+        l.name = name
 
 def skin_resize(image, ratio_string='4/3'):
     ratio = map(float, ratio_string.split('/'))
@@ -219,37 +78,242 @@ def skin_resize(image, ratio_string='4/3'):
     background_land = pdb.gimp_image_get_layer_by_name(image, 'background_land.png')
     pdb.gimp_layer_resize(background_land, background_port.width, background_port.height, round(background_port.width/2) - round(background_land.width/2), round(background_port.height/2) - round(background_land.height/2))
 
-def skin_update_copy(image_source, ratio_index, scale_index):
-    image = pdb.gimp_image_duplicate(image_source)
-    pdb.gimp_image_undo_disable(image)
-    
-    # Scale to screen density
-    if scale_index: skin_scale(image, DENSITIES[scale_index][0])
-
-    # Rotate
+def skin_orient(image, index=None):
+    """ Rotate the portrait group to landscape, or the opposite, when the target group is missing or hidden """
+    index = index or LayerIndex(image)
     direction = ['portrait','landscape']
     layer_orientation = [layer.name for layer in image.layers if layer.name in direction][0]
     # inverse direction
     direction.insert(0, direction.pop()) if layer_orientation == direction[1] else None
-    layer_group = find_layer(image, direction[0])
+    layer_group = index.find_layer(direction[0])
     target_group = pdb.gimp_image_get_layer_by_name(image, direction[1])
-    if not target_group or not target_group.visible: skin_rotate_group(image, layer_group, direction)
+    if not target_group or not target_group.visible: skin_rotate_group(image, layer_group, direction, index)
+
+def skin_update_copy(image_source, ratio_index, scale_index, stats=None):
+    stats = stats or ExportStats()
+    with stats.stage('duplicate'):
+        image = pdb.gimp_image_duplicate(image_source)
+        pdb.gimp_image_undo_disable(image)
+        index = LayerIndex(image)
+    
+    # Scale to screen density
+    with stats.stage('scale'):
+        if scale_index: skin_scale(image, DENSITIES[scale_index][0], index)
+
+    # Rotate
+    with stats.stage('rotate'):
+        skin_orient(image, index)
 
     # Update skin aspect ratio
-    if ratio_index: skin_resize(image, SKIN_RATIOS[ratio_index])
-    pdb.gimp_image_undo_enable(image)
+    with stats.stage('resize'):
+        if ratio_index: skin_resize(image, SKIN_RATIOS[ratio_index])
 
     return image
 
-def skin_export(image_source, layer, save_path, ratio_index=0, scale_index=0):
-    image = skin_update_copy(image_source, ratio_index, scale_index)
+def skin_remove_stamp(save_path):
+    """ Remove the stamp of save_path, so that a failed or unstamped export is not skipped """
     try:
-        pdb.python_fu_layout_export(image, None, save_path, False, False, True)
+        os.remove(os.path.join(save_path, SKIN_STAMP_FILE))
+    except OSError:
+        pass
+
+def skin_export_image(image, save_path, stats=None):
+    """ Export layers, layout.json and layout of image, a working copy that is changed:
+    linked layers are cropped in place, instead of exporting yet another copy of image,
+    and the layout is made from the cropped layers. The stamp of save_path is removed,
+    it is written again by skin_export_matrix once a stamped export succeeded """
+    stats = stats or ExportStats(image.name)
+    skin_remove_stamp(save_path)
+    pdb.gimp_image_undo_disable(image)
+    gimp_prepare_layers(image, crop_linked=True, stats=stats)
+    gimp_export_image(image, save_path, stats)
+    with stats.stage('layout'), stats.layer(SKIN_LAYOUT_FILE, os.path.join(save_path, SKIN_LAYOUT_FILE)):
         skin_export_layout(image, save_path)
+    stats.save(save_path)
+
+def skin_export(image_source, layer, save_path, ratio_index=0, scale_index=0):
+    stats = ExportStats(image_source.name)
+    image = skin_update_copy(image_source, ratio_index, scale_index, stats)
+    try:
+        skin_export_image(image, save_path, stats)
     finally:
         #display = pdb.gimp_display_new(image)
         pdb.gimp_image_delete(image)
 
+def skin_density_names(densities):
+    """ Returns density names from a string like "mdpi xhdpi", or "mdpi,xhdpi" """
+    names = densities.replace(',', ' ').split()
+    unknown = [d for d in names if d not in DENSITIES_MAP]
+    if unknown:
+        raise ValueError('Unknown densities: %s, expected: DEFAULT %s' % (' '.join(unknown), DENSITY_NAMES))
+    return names
+
+def skin_ratio_names(ratios):
+    """ Returns aspect ratios from a string like "DEFAULT 4/3", or "4x3,16x9" """
+    names = [r.replace('x', '/') for r in ratios.replace(',', ' ').split()]
+    unknown = [r for r in names if r != SKIN_RATIOS[0] and not re.match(r'^\d+/\d+$', r)]
+    if unknown:
+        raise ValueError('Unknown ratios: %s, expected: %s or <width>/<height>' % (' '.join(unknown), ' '.join(SKIN_RATIOS)))
+    return names
+
+def skin_matrix_path(save_path, density, ratio):
+    """ Returns <save_path>_<density>_<width>x<height>, DEFAULT density or ratio adds no suffix """
+    if density != DENSITIES[0][0]: save_path += '_' + density
+    if ratio != SKIN_RATIOS[0]: save_path += '_' + ratio.replace('/', 'x')
+    return save_path
+
+def skin_source_stamp(image_source):
+    """ Returns a stamp of the file image_source was loaded from, None when it has unsaved changes """
+    filename = pdb.gimp_image_get_filename(image_source)
+    if not filename or not os.path.isfile(filename) or pdb.gimp_image_is_dirty(image_source):
+        return None
+    st = os.stat(filename)
+    return repr((os.path.abspath(filename), st.st_size, st.st_mtime))
+
+def skin_export_settings():
+    """ Returns the settings that change exported files: export version, png profile and
+    mask format """
+    return repr((SKIN_EXPORT_VERSION, png_profile(), MASK_FORMAT))
+
+def skin_is_built(save_path, stamp):
+    """ Returns True when save_path was exported with the same stamp """
+    if not stamp or os.environ.get(SKIN_FORCE_ENV) or not os.path.isfile(os.path.join(save_path, SKIN_LAYOUT_FILE)):
+        return False
+    try:
+        with open(os.path.join(save_path, SKIN_STAMP_FILE), 'r') as f:
+            return f.read() == stamp
+    except IOError:
+        return False
+
+def skin_duplicate(image):
+    image_copy = pdb.gimp_image_duplicate(image)
+    pdb.gimp_image_undo_disable(image_copy)
+    return image_copy
+
+def skin_export_matrix(image_source, layer, save_path, densities=DENSITIES[0][0], ratios=SKIN_RATIOS[0]):
+    """ Export the skin for each density and aspect ratio, to skin_matrix_path directories.
+    Stages are shared: the portrait/landscape rotation is done once, scaling once per
+    density, and each ratio is resized from the scaled image. Images are exported in place,
+    the last stage using an image gets it, others get a copy. Outputs already exported
+    from the same saved xcf file with the same settings are skipped, unless XCF_FORCE is set
+    """
+    source_stamp = skin_source_stamp(image_source)
+    settings = skin_export_settings()
+    leaves = OrderedDict()
+    for density in skin_density_names(densities):
+        for ratio in skin_ratio_names(ratios):
+            path = skin_matrix_path(save_path, density, ratio)
+            stamp = source_stamp and repr((source_stamp, density, ratio, settings))
+            if skin_is_built(path, stamp):
+                print 'SKIN UNCHANGED: %s' % path
+                continue
+            leaves.setdefault(density, []).append((ratio, path, stamp))
+    if not leaves:
+        return
+
+    shared_stats = ExportStats()
+    with shared_stats.stage('duplicate'):
+        image_oriented = skin_duplicate(image_source)
+    try:
+        with shared_stats.stage('rotate'):
+            skin_orient(image_oriented)
+        # DEFAULT density last, it can use the rotated image itself
+        leaves = sorted(leaves.items(), key=lambda l: l[0] == DENSITIES[0][0])
+        for density, density_leaves in leaves:
+            density_stats = ExportStats()
+            density_stats.stages.extend(shared_stats.stages)
+            image_scaled = image_oriented
+            if density != leaves[-1][0]:
+                with density_stats.stage('duplicate'):
+                    image_scaled = skin_duplicate(image_oriented)
+            try:
+                with density_stats.stage('scale'):
+                    if density != DENSITIES[0][0]: skin_scale(image_scaled, density)
+                for ratio, path, stamp in density_leaves:
+                    # Shared stages are reported with each output
+                    stats = ExportStats('%s (%s, %s)' % (image_source.name, density, ratio))
+                    stats.stages.extend(OrderedDict(s, shared=True) for s in density_stats.stages)
+                    image = image_scaled
+                    if ratio != density_leaves[-1][0]:
+                        with stats.stage('duplicate'):
+                            image = skin_duplicate(image_scaled)
+                    try:
+                        with stats.stage('resize'):
+                            if ratio != SKIN_RATIOS[0]: skin_resize(image, ratio)
+                        skin_export_image(image, path, stats)
+                    finally:
+                        if image is not image_scaled: pdb.gimp_image_delete(image)
+                    if stamp:
+                        with open(os.path.join(path, SKIN_STAMP_FILE), 'w') as f:
+                            f.write(stamp)
+            finally:
+                if image_scaled is not image_oriented: pdb.gimp_image_delete(image_scaled)
+    finally:
+        pdb.gimp_image_delete(image_oriented)
+
+def skin_export_densities(image_source, layer, save_path, ratio_index=0, densities=DENSITY_NAMES):
+    """ Export the skin once per density, to <save_path>_<density> directories,
+    suffixed with the aspect ratio unless DEFAULT. See skin_export_matrix
+    """
+    skin_export_matrix(image_source, layer, save_path, densities, SKIN_RATIOS[ratio_index])
+
+def skin_export_xcf(xcf_path, densities=None, ratios=None):
+    png_path = os.path.splitext(xcf_path)[0]
+    image = pdb.gimp_xcf_load(0, xcf_path, xcf_path)
+    try:
+        skin_export_matrix(image, None, png_path, densities or DENSITIES[0][0], ratios or SKIN_RATIOS[0])
+    finally:
+        pdb.gimp_image_delete(image)
+
+def skin_export_job(xcf_path, job, densities=None, ratios=None):
+    """ Export xcf_path, writing the result of job to '<job>.ok' or '<job>.err' """
+    start = time.time()
+    try:
+        skin_export_xcf(xcf_path, densities, ratios)
+    except Exception:
+        with open(job + '.err', 'w') as f:
+            f.write(traceback.format_exc())
+    else:
+        with open(job + '.ok', 'w') as f:
+            f.write('%.1fs\n' % (time.time() - start))
+
+def skin_export_jobs(jobs_path, densities=None, ratios=None):
+    """ Export every xcf file listed in jobs_path, one per line, optionally followed
+    by a tab and the densities of this job, to split densities of a file across workers.
+    Several workers can share the same jobs file: job <n> is claimed by creating
+    '<n>.claim' next to it, its result is written to '<n>.ok' or '<n>.err'
+    """
+    jobs_dir = os.path.dirname(jobs_path)
+    with open(jobs_path) as f:
+        xcf_paths = [l.rstrip('\n') for l in f if l.strip()]
+
+    for i, line in enumerate(xcf_paths):
+        xcf_path, _, job_densities = line.partition('\t')
+        job = os.path.join(jobs_dir, str(i))
+        try:
+            os.close(os.open(job + '.claim', os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except OSError:
+            # Claimed by another worker
+            continue
+        skin_export_job(xcf_path, job, job_densities or densities, ratios)
+
+def skin_export_watch(queue_dir, densities=None, ratios=None, interval=0.2):
+    """ Export xcf files queued in queue_dir, until a 'stop' file is created there.
+    Job <n> is queued as '<n>.job' holding the xcf path, claimed by renaming it
+    to '<n>.run', its result is written to '<n>.ok' or '<n>.err'
+    """
+    stop_path = os.path.join(queue_dir, 'stop')
+    while not os.path.exists(stop_path):
+        jobs = sorted(int(n[:-len('.job')]) for n in os.listdir(queue_dir) if n.endswith('.job'))
+        if not jobs:
+            time.sleep(interval)
+            continue
+        job = os.path.join(queue_dir, str(jobs[0]))
+        os.rename(job + '.job', job + '.run')
+        with open(job + '.run') as f:
+            xcf_path = f.read().rstrip('\n')
+        skin_export_job(xcf_path, job, densities, ratios)
+
 if __name__=='__main__':
     
     try:
@@ -259,11 +323,17 @@ if __name__=='__main__':
         interactive = True
     
     if not interactive:
+        xcf_jobs = os.environ.get('XCF_JOBS')
+        xcf_watch = os.environ.get('XCF_WATCH')
         xcf_path = os.environ.get('XCF_FILE')
-        if xcf_path:
-            png_path = os.path.splitext(xcf_path)[0]
-            image = pdb.gimp_xcf_load(0, xcf_path, xcf_path)
-            skin_export(image, None, png_path)
+        xcf_densities = os.environ.get('XCF_DENSITIES')
+        xcf_ratios = os.environ.get('XCF_RATIOS')
+        if xcf_watch:
+            skin_export_watch(xcf_watch, xcf_densities, xcf_ratios)
+        elif xcf_jobs:
+            skin_export_jobs(xcf_jobs, xcf_densities, xcf_ratios)
+        elif xcf_path:
+            skin_export_xcf(xcf_path, xcf_densities, xcf_ratios)
 
     else:
         from gimpfu import *
@@ -281,5 +351,31 @@ if __name__=='__main__':
                         [], 
                         skin_export) #, menu, domain, on_query, on_run)
 
+        register("python_fu_extract_skin_densities", 
+                        "Export Android Skin for each density", 
+                        "Export Android Emulator Skin for each density, to <Export Path>_<density> directories", 
+                        "Nic", "Nicolas CORNETTE", "2014", 
+                        "<Image>/File/Export/Export Emulator Skin Densities...", 
+                        "*", [
+                            (PF_DIRNAME, "save-path", "Export Path", DEFAULT_OUTPUT_DIR),
+                            (PF_OPTION, "ratio", "Window aspect ratio", 0, SKIN_RATIOS),
+                            (PF_STRING, "densities", "Densities", DENSITY_NAMES),
+                              ], 
+                        [], 
+                        skin_export_densities) #, menu, domain, on_query, on_run)
+
+        register("python_fu_extract_skin_matrix", 
+                        "Export Android Skin for each density and ratio", 
+                        "Export Android Emulator Skin for each density and aspect ratio, to <Export Path>_<density>_<ratio> directories", 
+                        "Nic", "Nicolas CORNETTE", "2014", 
+                        "<Image>/File/Export/Export Emulator Skin Matrix...", 
+                        "*", [
+                            (PF_DIRNAME, "save-path", "Export Path", DEFAULT_OUTPUT_DIR),
+                            (PF_STRING, "densities", "Densities", ' '.join(d[0] for d in DENSITIES)),
+                            (PF_STRING, "ratios", "Window aspect ratios", ' '.join(SKIN_RATIOS)),
+                              ], 
+                        [], 
+                        skin_export_matrix) #, menu, domain, on_query, on_run)
+
         main()
 
@@ -0,0 +1,18 @@
+""" Fake Gimp layers, for tests and benchmarks without Gimp
+"""
+
+
+# Fake Gimp Layer
+class FakeLayer(object):
+    def __init__(self, name, width, height):
+        self.name = name
+        self.width = width
+        self.height = height
+
+
+# Fake Gimp Layer Group
+class FakeGroup(FakeLayer):
+    def __init__(self, name, width, height, unsupported, layers):
+        super(FakeGroup, self).__init__(name, width, height)
+        self.unsupported = unsupported
+        self.layers = layers
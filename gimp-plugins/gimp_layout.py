@@ -0,0 +1,407 @@
+""" Gimp independent helpers for layer trees and layout.json
+
+Layer trees are either Gimp images or objects loaded from layout.json
+"""
+
+import os
+import re
+import functools
+import json as _json
+
+from collections import namedtuple
+from collections import OrderedDict
+
+gimp_required_fields = ('name', 'width', 'height')
+gimp_extra_fields = ('visible', 'linked', 'opacity', 'mode', 'offsets', 'mask', 'layers')
+
+JSON_LAYOUT_FILE = 'layout.json'
+JSON_MANIFEST_FILE = 'layout.manifest.json'
+
+# Masks are exported to 8 bits gray png files, imported by copying their pixels.
+# Masks of layout.json files without format are imported through colortoalpha
+MASK_FORMAT = 'gray8'
+
+
+def gimp_import_manifest(save_path):
+    """ Returns layers exported previously to save_path: {name: {hash, size}}
+    """
+    try:
+        with open(os.path.join(save_path, JSON_MANIFEST_FILE), 'r') as f:
+            return _json.load(f)['layers']
+    except (IOError, ValueError, KeyError):
+        return {}
+
+
+def gimp_export_manifest(save_path, layers):
+    with open(os.path.join(save_path, JSON_MANIFEST_FILE), 'w') as f:
+        _json.dump(OrderedDict([('layers', layers)]), f, indent=2, sort_keys=True)
+
+
+def unlink_shared(filepath):
+    """ Remove filepath when it is a symlink or a hardlink, shared with other
+    files by skin_dedupe.py, so that writing it does not change the other files
+    """
+    if os.path.islink(filepath) or \
+            (os.path.isfile(filepath) and os.stat(filepath).st_nlink > 1):
+        os.remove(filepath)
+
+
+def owned_attrs(o, *fields):
+    return [f for f in fields if hasattr(o, f)]
+
+
+def hasattrs(o, *fields):
+    return len(owned_attrs(o, *fields)) == len(fields)
+
+
+def getattrs(o, *fields):
+    return [(f, getattr(o, f)) for f in fields]
+
+
+def as_ordered_dict(obj, required_attrs, extra_attrs):
+    object_attrs = list(required_attrs)
+
+    if hasattrs(obj, *required_attrs):
+        object_attrs.extend(owned_attrs(obj, *extra_attrs))
+        return OrderedDict(getattrs(obj, *object_attrs))
+
+
+# Record types by keys, objects having the same keys share the same type
+_json_object_types = {}
+
+
+def _json_object_hook(d):
+    keys = tuple(d.keys())
+    object_type = _json_object_types.get(keys)
+    if object_type is None:
+        object_type = _json_object_types[keys] = namedtuple('GimpObject', keys)
+    return object_type(*d.values())
+
+
+def mask_ordered_dict(mask):
+    """ Returns the layout.json object of a layer mask, with the format of its file
+    """
+    mask_dict = as_ordered_dict(mask, gimp_required_fields, gimp_extra_fields)
+    mask_dict['format'] = MASK_FORMAT
+    return mask_dict
+
+
+class GimpJSONEncoder(_json.JSONEncoder):
+    def default(self, obj):
+        obj_dict = as_ordered_dict(obj, gimp_required_fields, gimp_extra_fields)
+        if obj_dict is None:
+            return _json.JSONEncoder.default(self, obj)
+        if obj_dict.get('mask') is not None:
+            obj_dict['mask'] = mask_ordered_dict(obj_dict['mask'])
+        return obj_dict
+
+
+# Customize my json
+json = namedtuple('GimpJson', 'load loads dump dumps')(
+        load=functools.partial(_json.load, object_hook=_json_object_hook),
+        loads=functools.partial(_json.loads, object_hook=_json_object_hook),
+        dump=functools.partial(_json.dump, cls=GimpJSONEncoder, indent=2),
+        dumps=functools.partial(_json.dumps, cls=GimpJSONEncoder, indent=2),
+)
+
+
+try:
+    _string_types = (str, unicode)
+    _integer_types = (int, long)
+except NameError:
+    _string_types = (str,)
+    _integer_types = (int,)
+
+_encode_string = _json.encoder.encode_basestring_ascii
+
+
+def _float_repr(value):
+    if value != value:
+        return 'NaN'
+    if value in (float('inf'), float('-inf')):
+        return value > 0 and 'Infinity' or '-Infinity'
+    return float.__repr__(value)
+
+
+# Chunks written to the file at once by LayoutWriter
+WRITE_CHUNKS = 1024
+
+
+def _type_key(obj):
+    """ Returns the key of the fields of obj, objects of the same class have the same
+    fields, unless attributes are set on instances, like fakes do
+    """
+    cls = obj.__class__
+    if type(obj).__dictoffset__ or cls is not type(obj):
+        return cls, tuple(obj.__dict__)
+    return cls
+
+
+class LayoutWriter(object):
+    """ Write a layer tree to a file as layout.json, layers are written as they are
+    traversed. Output is the one of json.dump with GimpJSONEncoder and indent=2, fields
+    of each type of object are resolved once instead of once per object
+    """
+
+    def __init__(self, f, separators=(', ', ': ')):
+        self.f = f
+        self.item_separator, self.key_separator = separators
+        self._chunks = []
+        self._fields = {}
+        self._indents = {}
+        self._keys = {}
+
+    def fields(self, obj):
+        """ Returns fields of obj written to layout.json, None when obj is no layer
+        """
+        key = _type_key(obj)
+        try:
+            return self._fields[key]
+        except KeyError:
+            fields = None
+            if hasattrs(obj, *gimp_required_fields):
+                fields = gimp_required_fields + tuple(owned_attrs(obj, *gimp_extra_fields))
+            self._fields[key] = fields
+            return fields
+
+    def indent(self, level):
+        try:
+            return self._indents[level]
+        except KeyError:
+            indent = self._indents[level] = '\n' + ' ' * (2 * level)
+            return indent
+
+    def key(self, name, level):
+        """ Returns the indent, name and key separator of a field at level
+        """
+        try:
+            return self._keys[name, level]
+        except KeyError:
+            if not isinstance(name, _string_types):
+                name = _json.dumps(name)
+            key = self._keys[name, level] = \
+                self.indent(level) + _encode_string(name) + self.key_separator
+            return key
+
+    def write(self, chunk):
+        chunks = self._chunks
+        chunks.append(chunk)
+        if len(chunks) >= WRITE_CHUNKS:
+            self.flush()
+
+    def flush(self):
+        self.f.write(''.join(self._chunks))
+        del self._chunks[:]
+
+    def dump(self, obj):
+        self.value(obj, 0)
+        self.flush()
+
+    def value(self, value, level):
+        # Same order of types as json
+        write = self.write
+        if isinstance(value, _string_types):
+            write(_encode_string(value))
+        elif value is None:
+            write('null')
+        elif value is True:
+            write('true')
+        elif value is False:
+            write('false')
+        elif isinstance(value, _integer_types):
+            write('%d' % value)
+        elif isinstance(value, float):
+            write(_float_repr(value))
+        elif isinstance(value, (list, tuple)):
+            self.items(value, level)
+        elif isinstance(value, dict):
+            self.pairs(value.items(), level)
+        else:
+            self.object(value, level)
+
+    def items(self, values, level):
+        if not values:
+            self.write('[]')
+            return
+        indent = self.indent(level + 1)
+        separator = self.item_separator + indent
+        self.write('[' + indent)
+        for i, value in enumerate(values):
+            if i:
+                self.write(separator)
+            self.value(value, level + 1)
+        self.write(self.indent(level) + ']')
+
+    def pairs(self, pairs, level):
+        write = self.write
+        separator = '{'
+        for name, value in pairs:
+            write(separator + self.key(name, level + 1))
+            separator = self.item_separator
+            self.value(value, level + 1)
+        write(separator == '{' and '{}' or self.indent(level) + '}')
+
+    def object(self, obj, level, mask=False):
+        fields = self.fields(obj)
+        if fields is None:
+            raise TypeError('%r is not JSON serializable' % (obj,))
+        write = self.write
+        separator = '{'
+        for name in fields:
+            value = getattr(obj, name)
+            write(separator + self.key(name, level + 1))
+            separator = self.item_separator
+            if name == 'mask' and value is not None:
+                self.object(value, level + 1, mask=True)
+            else:
+                self.value(value, level + 1)
+        if mask:
+            # Masks are flagged with the format of their files
+            write(separator + self.key('format', level + 1) + _encode_string(MASK_FORMAT))
+        write(self.indent(level) + '}')
+
+
+def dump_layout(image, f):
+    """ Write layout.json of image to file f, as Gimp python writes it with json.dump
+    """
+    LayoutWriter(f).dump(image)
+
+
+def load_layout_dict(f):
+    """ Returns layout.json content of file f as OrderedDicts, to be edited without Gimp
+    """
+    return _json.load(f, object_pairs_hook=OrderedDict)
+
+
+def dump_layout_dict(obj, f):
+    # Same format as layout.json files written by Gimp python
+    _json.dump(obj, f, indent=2, separators=(', ', ': '))
+
+
+def getlayers(group):
+    """ Returns a generator of layers and sub-layers
+    result is a tuple (parent,layer)
+    """
+    for layer in group.layers:
+        yield group, layer
+        if hasattr(layer, 'mask'):
+            if layer.mask:
+                yield layer, layer.mask
+        if hasattr(layer, 'layers'):
+            for g, l in getlayers(layer):
+                yield g, l
+
+
+def find_layers(group, name):
+    return [l for p, l in getlayers(group) if re.match(name, l.name)]
+
+
+def find_layer(group, name):
+    layers = find_layers(group, name)
+    return layers and layers[0] or None
+
+
+def _layer_key(layer):
+    # Gimp returns a new wrapper object on each access, its ID is stable
+    return getattr(layer, 'ID', None) or id(layer)
+
+
+class LayerIndex(object):
+    """ Index of the layers of an image by name, with parent links.
+    Build it once per image, then keep it up to date with insert, rename and remove
+    """
+
+    def __init__(self, image):
+        self.image = image
+        self._layers = {}
+        self._names = {}
+        self._layer_names = {}
+        self._parents = {}
+        self._children = {None: []}
+        self._masks = {}
+        self._patterns = {}
+        for layer in image.layers:
+            self.insert(layer)
+
+    def _add(self, layer, parent_key):
+        key = _layer_key(layer)
+        self._layers[key] = layer
+        self._layer_names[key] = layer.name
+        self._names.setdefault(layer.name, []).append(key)
+        self._parents[key] = parent_key
+        return key
+
+    def insert(self, layer, parent=None, position=None):
+        """ Add layer, its mask and sub-layers, at position in parent layers
+        """
+        parent_key = parent is not None and _layer_key(parent) or None
+        key = self._add(layer, parent_key)
+        siblings = self._children[parent_key]
+        siblings.insert(len(siblings) if position is None else position, key)
+        self._children[key] = []
+        if getattr(layer, 'mask', None):
+            self._masks[key] = self._add(layer.mask, key)
+        for sub_layer in getattr(layer, 'layers', ()):
+            self.insert(sub_layer, layer)
+
+    def rename(self, layer, name):
+        key = _layer_key(layer)
+        self._names[self._layer_names[key]].remove(key)
+        self._layer_names[key] = name
+        self._names.setdefault(name, []).append(key)
+
+    def remove(self, layer):
+        """ Remove layer, its mask and sub-layers
+        """
+        key = _layer_key(layer)
+        parent_key = self._parents[key]
+        if self._masks.get(parent_key) == key:
+            del self._masks[parent_key]
+        else:
+            self._children[parent_key].remove(key)
+        for k in list(self._walk(key)) + [key]:
+            self._names[self._layer_names[k]].remove(k)
+            for d in (self._layers, self._layer_names, self._parents,
+                      self._children, self._masks):
+                d.pop(k, None)
+
+    def _walk(self, parent_key):
+        # Same order as getlayers()
+        for key in self._children.get(parent_key, ()):
+            yield key
+            if key in self._masks:
+                yield self._masks[key]
+            for k in self._walk(key):
+                yield k
+
+    def parent(self, layer):
+        parent_key = self._parents[_layer_key(layer)]
+        return parent_key is not None and self._layers[parent_key] or None
+
+    def get(self, name):
+        """ Returns the first layer named name, None if there is none
+        """
+        keys = self._names.get(name)
+        if not keys:
+            return None
+        if len(keys) > 1:
+            keys = [k for k in self._walk(None) if k in keys]
+        return self._layers[keys[0]]
+
+    def _pattern(self, pattern):
+        if pattern not in self._patterns:
+            self._patterns[pattern] = re.compile(pattern)
+        return self._patterns[pattern]
+
+    def iter_layers(self, name, group=None):
+        """ Returns a generator of layers matching name regex in group, all layers by default
+        """
+        match = self._pattern(name).match
+        group_key = group is not None and group is not self.image and _layer_key(group) or None
+        return (self._layers[k] for k in self._walk(group_key) if match(self._layer_names[k]))
+
+    def find_layers(self, name, group=None):
+        return list(self.iter_layers(name, group))
+
+    def find_layer(self, name, group=None):
+        return next(self.iter_layers(name, group), None)
@@ -0,0 +1,242 @@
+""" Png encoding with compression profiles, large pictures are deflated in parallel.
+
+Profiles are selected by the SKIN_PNG_PROFILE environment variable:
+  gimp      level 9, as file_png_save2 and the Pillow saves did, the default
+  fast      level 1 without filters, for quick iteration exports
+  release   level 9, adaptive row filters (NumPy) and the smallest of two deflate
+            strategies for each chunk, for the smallest skins
+  store     no compression
+
+Rows are filtered and cut into chunks deflated in a pool of threads, zlib releases
+the GIL. Chunks end on a sync flush so that they are concatenated into one zlib
+stream, each one primed with the end of the previous one when zlib supports it.
+"""
+
+import os
+import zlib
+import struct
+import multiprocessing
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+from skin_layout import PNG_SIGNATURE
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+PNG_PROFILE_ENV = 'SKIN_PNG_PROFILE'
+
+# level, row filters, deflate strategies
+PNG_PROFILES = {
+    'gimp': (9, 'none', (zlib.Z_DEFAULT_STRATEGY,)),
+    'fast': (1, 'none', (zlib.Z_DEFAULT_STRATEGY,)),
+    'release': (9, 'adaptive', (zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED)),
+    'store': (0, 'none', (zlib.Z_DEFAULT_STRATEGY,)),
+}
+DEFAULT_PNG_PROFILE = 'gimp'
+
+# Pillow save options of profiles, for pictures saved by Pillow
+PIL_SAVE_OPTIONS = {
+    'gimp': dict(compress_level=9),
+    'fast': dict(compress_level=1),
+    'release': dict(optimize=True),
+    'store': dict(compress_level=0),
+}
+
+# Png color types of drawable types: RGB, RGBA, GRAY, GRAYA, INDEXED, INDEXEDA.
+# Indexed drawables with alpha are written as RGBA
+PNG_COLOR_TYPES = (2, 6, 0, 4, 3, 6)
+PNG_COLOR_GRAY = 0
+PNG_IDAT_SIZE = 1 << 16
+
+# Uncompressed bytes deflated by each thread, the deflate window is 32KB
+CHUNK_SIZE = 1 << 20
+WINDOW_SIZE = 1 << 15
+# zlib header of levels 0-1, 2-5, 6 and 7-9
+ZLIB_HEADERS = (b'\x78\x01', b'\x78\x01', b'\x78\x5e', b'\x78\x5e', b'\x78\x5e', b'\x78\x5e',
+                b'\x78\x9c', b'\x78\xda', b'\x78\xda', b'\x78\xda')
+
+_deflate_pool = None
+_deflate_threads = multiprocessing.cpu_count()
+
+
+def png_profile(name=None):
+    """ Returns the profile name, SKIN_PNG_PROFILE by default
+    """
+    name = name or os.environ.get(PNG_PROFILE_ENV) or DEFAULT_PNG_PROFILE
+    if name not in PNG_PROFILES:
+        raise ValueError('Unknown png profile: %s, expected: %s' %
+                         (name, ' '.join(sorted(PNG_PROFILES))))
+    return name
+
+
+def deflate_pool():
+    global _deflate_pool
+    if _deflate_pool is None:
+        _deflate_pool = ThreadPool(_deflate_threads)
+    return _deflate_pool
+
+
+def png_chunk(chunk_type, data):
+    return struct.pack('>I', len(data)) + chunk_type + data + \
+        struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff)
+
+
+def indexed_to_rgba(rows, colormap):
+    """ Yields RGBA rows of indexed rows with alpha
+    """
+    palette = [bytearray(colormap[i:i + 3]) for i in range(0, len(colormap), 3)]
+    for row in rows:
+        # Python 2 rows are str, their items are no indexes
+        row = bytearray(row)
+        rgba = bytearray(len(row) * 2)
+        for i in range(0, len(row), 2):
+            rgba[i * 2:i * 2 + 3] = palette[row[i]]
+            rgba[i * 2 + 3] = row[i + 1]
+        yield rgba
+
+
+def _paeth(a, b, c):
+    p = a + b - c
+    pa, pb, pc = numpy.abs(p - a), numpy.abs(p - b), numpy.abs(p - c)
+    return numpy.where((pa <= pb) & (pa <= pc), a, numpy.where(pb <= pc, b, c))
+
+
+def filter_adaptive(rows, previous, bpp):
+    """ Returns filtered rows, the filter of each row is the one with the smallest sum of
+    absolute values, as libpng chooses. previous is the row before rows, or None
+    """
+    raw = numpy.frombuffer(b''.join(bytes(r) for r in rows), numpy.uint8)
+    raw = raw.reshape(len(rows), -1).astype(numpy.int16)
+    up = numpy.zeros_like(raw)
+    if previous is not None:
+        up[0] = numpy.frombuffer(bytes(previous), numpy.uint8)
+    up[1:] = raw[:-1]
+    left = numpy.zeros_like(raw)
+    left[:, bpp:] = raw[:, :-bpp]
+    up_left = numpy.zeros_like(raw)
+    up_left[:, bpp:] = up[:, :-bpp]
+    candidates = numpy.stack([raw, raw - left, raw - up, raw - (left + up) // 2,
+                              raw - _paeth(left, up, up_left)]).astype(numpy.uint8)
+    costs = numpy.abs(candidates.view(numpy.int8).astype(numpy.int32)).sum(axis=2)
+    filters = costs.argmin(axis=0)
+    filtered = candidates[filters, numpy.arange(len(rows))]
+    return numpy.hstack([filters.astype(numpy.uint8)[:, None], filtered]).tobytes()
+
+
+def filter_rows(rows, previous, bpp, filters):
+    if filters == 'adaptive' and numpy is not None:
+        return filter_adaptive(rows, previous, bpp)
+    return b''.join(b'\0' + bytes(r) for r in rows)
+
+
+def deflate_chunk(args):
+    """ Returns the smallest raw deflate of data with strategies, ended by a sync flush,
+    or by the end of stream when last. zdict primes the window with previous data
+    """
+    data, zdict, level, strategies, last = args
+    best = None
+    for strategy in strategies:
+        try:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -15, 9, strategy,
+                                          **(zdict and {'zdict': zdict} or {}))
+        except TypeError:
+            # Python 2 zlib has no preset dictionary
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -15, 9, strategy)
+        deflated = compressor.compress(data) + \
+            compressor.flush(last and zlib.Z_FINISH or zlib.Z_SYNC_FLUSH)
+        if best is None or len(deflated) < len(best):
+            best = deflated
+    return best
+
+
+def _chunks(rows, chunk_size):
+    chunk, size = [], 0
+    for row in rows:
+        chunk.append(row)
+        size += len(row)
+        if size >= chunk_size:
+            yield chunk
+            chunk, size = [], 0
+    if chunk:
+        yield chunk
+
+
+def deflate_rows(rows, bpp, profile=None, chunk_size=CHUNK_SIZE):
+    """ Yields pieces of the zlib stream of filtered rows, chunks of rows are filtered
+    and deflated in parallel, with a bounded number of chunks in flight
+    """
+    level, filters, strategies = PNG_PROFILES[png_profile(profile)]
+    pool = deflate_pool()
+    pending = deque()
+    previous, zdict, adler = None, None, 1
+    yield ZLIB_HEADERS[level]
+    chunks = _chunks(rows, chunk_size)
+    chunk = next(chunks, None)
+    while chunk is not None:
+        data = filter_rows(chunk, previous, bpp, filters)
+        adler = zlib.adler32(data, adler)
+        previous = chunk[-1]
+        next_chunk = next(chunks, None)
+        pending.append(pool.apply_async(deflate_chunk, ((data, zdict, level, strategies,
+                                                         next_chunk is None),)))
+        zdict = data[-WINDOW_SIZE:]
+        chunk = next_chunk
+        while len(pending) > _deflate_threads or (chunk is None and pending):
+            yield pending.popleft().get()
+    if previous is None:
+        yield deflate_chunk((b'', None, level, strategies, True))
+    yield struct.pack('>I', adler & 0xffffffff)
+
+
+def write_png(filepath, width, height, color_type, rows, palette=None, resolution=None,
+              comment=None, profile=None):
+    """ Write rows of pixels to a png file, rows are compressed as they come
+    """
+    bpp = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}[color_type]
+    temp = filepath + '.tmp'
+    with open(temp, 'wb') as f:
+        f.write(PNG_SIGNATURE)
+        f.write(png_chunk(b'IHDR', struct.pack('>2I5B', width, height, 8, color_type, 0, 0, 0)))
+        if palette:
+            f.write(png_chunk(b'PLTE', bytes(palette)))
+        if resolution:
+            # Pixels per meter
+            ppm = [int(round(r / 0.0254)) for r in resolution]
+            f.write(png_chunk(b'pHYs', struct.pack('>2IB', ppm[0], ppm[1], 1)))
+        if comment:
+            f.write(png_chunk(b'tEXt', b'Comment\0' + comment.encode('latin-1', 'replace')))
+        data, size = [], 0
+        for piece in deflate_rows(rows, bpp, profile):
+            data.append(piece)
+            size += len(piece)
+            if size >= PNG_IDAT_SIZE:
+                f.write(png_chunk(b'IDAT', b''.join(data)))
+                data, size = [], 0
+        if data:
+            f.write(png_chunk(b'IDAT', b''.join(data)))
+        f.write(png_chunk(b'IEND', b''))
+    os.rename(temp, filepath)
+
+
+# Pillow modes written by write_png
+PIL_COLOR_TYPES = {'L': 0, 'RGB': 2, 'LA': 4, 'RGBA': 6}
+
+
+def save_image(image, filepath, profile=None):
+    """ Save a Pillow image to a png file with a profile, through a temporary file
+    """
+    profile = png_profile(profile)
+    color_type = PIL_COLOR_TYPES.get(image.mode)
+    if profile == DEFAULT_PNG_PROFILE or color_type is None:
+        temp = filepath + '.tmp'
+        image.save(temp, 'PNG', **PIL_SAVE_OPTIONS[profile])
+        os.rename(temp, filepath)
+        return
+    width, height = image.size
+    pixels = image.tobytes()
+    row_size = len(pixels) // height
+    rows = (pixels[y * row_size:(y + 1) * row_size] for y in range(height))
+    write_png(filepath, width, height, color_type, rows, profile=profile)
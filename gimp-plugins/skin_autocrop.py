@@ -0,0 +1,204 @@
+#! /usr/bin/env python
+""" Autocrop layers of exported skins to their alpha bounds, without Gimp.
+
+Bounds of png layers are computed with NumPy in a pool of processes, cropped files
+replace the exported ones, offsets and sizes are updated in layout.json and button
+positions in layout. Linked layers are cropped, like the Gimp skin export does,
+background and screen layers never are.
+
+USAGE : skin_autocrop.py [-j workers] [--visible|--all] <skin_dir> [...]
+"""
+from __future__ import print_function
+
+import os
+import re
+import sys
+import argparse
+import multiprocessing
+
+from gimp_layout import JSON_LAYOUT_FILE, load_layout_dict, dump_layout_dict
+from skin_layout import SKIN_LAYOUT_FILE, skin_layout, skin_import_json, is_png
+from png_encode import save_image
+
+try:
+    import numpy
+    from PIL import Image
+except ImportError:
+    numpy, Image = None, None
+
+# Layers the emulator layout depends on at their full size
+KEEP_LAYERS = re.compile(r'^(background|screen)')
+
+LAYOUT_BUTTON = re.compile(r'(image\s+(\S+)\s+x\s+)(-?\d+)(\s+y\s+)(-?\d+)')
+
+
+def alpha_bounds(image):
+    """ Returns the (left, upper, right, lower) box of non transparent pixels,
+    None if image has no alpha or is fully transparent
+    """
+    if image.mode == 'P' and 'transparency' in image.info:
+        image = image.convert('RGBA')
+    if 'A' not in image.getbands():
+        return None
+    alpha = numpy.asarray(image.getchannel('A'))
+    rows = numpy.flatnonzero(alpha.max(axis=1))
+    if not rows.size:
+        return None
+    columns = numpy.flatnonzero(alpha.max(axis=0))
+    return int(columns[0]), int(rows[0]), int(columns[-1]) + 1, int(rows[-1]) + 1
+
+
+def crop_png(args):
+    """ Crop a png file and its mask file to alpha bounds.
+    Returns (filepath, box), box is None when the file is left unchanged
+    """
+    filepath, mask_filepath = args
+    image = Image.open(filepath)
+    image.load()
+    box = alpha_bounds(image)
+    if not box or box == (0, 0) + image.size:
+        return filepath, None
+    save_image(image.crop(box), filepath)
+    if mask_filepath:
+        mask = Image.open(mask_filepath)
+        mask.load()
+        save_image(mask.crop(box), mask_filepath)
+    return filepath, box
+
+
+def select_layers(layer, select):
+    """ Yields layout.json layers to crop, select(layer) tells crop candidates
+    """
+    for sub_layer in layer.get('layers', ()):
+        if 'layers' in sub_layer:
+            for l in select_layers(sub_layer, select):
+                yield l
+        elif select(sub_layer) and not KEEP_LAYERS.match(sub_layer['name']):
+            yield sub_layer
+
+
+def skin_autocrop_tasks(skin_dir, select):
+    """ Returns layout.json objects of skin_dir, layers to crop by file path,
+    and the list of (filepath, mask_filepath) cropping tasks
+    """
+    with open(os.path.join(skin_dir, JSON_LAYOUT_FILE), 'r') as f:
+        image = load_layout_dict(f)
+    if not isinstance(image.get('layers'), list):
+        raise ValueError('unsupported %s format' % JSON_LAYOUT_FILE)
+
+    layers, tasks = {}, []
+    for layer in select_layers(image, select):
+        filepath = os.path.join(skin_dir, layer['name'])
+        if filepath in layers or not os.path.isfile(filepath) or not is_png(filepath):
+            continue
+        mask_filepath = layer.get('mask') and os.path.join(skin_dir, layer['mask']['name'])
+        if mask_filepath and not os.path.isfile(mask_filepath):
+            mask_filepath = None
+        layers[filepath] = layer
+        tasks.append((filepath, mask_filepath))
+    return image, layers, tasks
+
+
+def crop_layer(layer, box):
+    """ Move offsets and set size of a layout.json layer to the cropped box
+    """
+    offsets = layer.get('offsets') or (0, 0)
+    layer['offsets'] = [offsets[0] + box[0], offsets[1] + box[1]]
+    layer['width'], layer['height'] = box[2] - box[0], box[3] - box[1]
+
+
+def shift_layout(layout, shifts):
+    """ Returns layout file content with positions of buttons moved by shifts[image]
+    """
+    def shift(match):
+        dx, dy = shifts.get(match.group(2), (0, 0))
+        return '%s%d%s%d' % (match.group(1), int(match.group(3)) + dx,
+                             match.group(4), int(match.group(5)) + dy)
+
+    return LAYOUT_BUTTON.sub(shift, layout)
+
+
+def skin_autocrop_layout(skin_dir, image, layers, boxes):
+    """ Write layout.json and layout of skin_dir with cropped layers
+    """
+    layout_filepath = os.path.join(skin_dir, SKIN_LAYOUT_FILE)
+    with open(layout_filepath, 'r') as f:
+        layout = f.read()
+    # A layout generated from layout.json is generated again, edited ones are shifted
+    try:
+        generated = skin_layout(skin_import_json(skin_dir)) == layout
+    except Exception:
+        generated = False
+
+    shifts = {}
+    for filepath, box in boxes.items():
+        layer = layers[filepath]
+        crop_layer(layer, box)
+        if layer.get('mask'):
+            crop_layer(layer['mask'], box)
+        shifts[layer['name']] = box[:2]
+
+    with open(os.path.join(skin_dir, JSON_LAYOUT_FILE), 'w') as f:
+        dump_layout_dict(image, f)
+    if generated:
+        layout = skin_layout(skin_import_json(skin_dir))
+    else:
+        layout = shift_layout(layout, shifts)
+    with open(layout_filepath, 'w') as f:
+        f.write(layout)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Autocrop layers of skins to alpha bounds')
+    parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(),
+                        help='number of worker processes, one per core by default')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--visible', action='store_const', dest='select', const='visible',
+                       help='crop visible layers instead of linked ones')
+    group.add_argument('--all', action='store_const', dest='select', const='all',
+                       help='crop all layers')
+    parser.add_argument('skin_dirs', nargs='+', metavar='skin_dir')
+    args = parser.parse_args(argv)
+
+    if numpy is None:
+        print('ERROR    NumPy and Pillow are required: pip install numpy Pillow',
+              file=sys.stderr)
+        return 2
+
+    select = {
+        'visible': lambda l: l.get('visible'),
+        'all': lambda l: True,
+    }.get(args.select, lambda l: l.get('linked'))
+
+    skins = []
+    for skin_dir in args.skin_dirs:
+        try:
+            skins.append((skin_dir,) + skin_autocrop_tasks(skin_dir, select))
+        except (IOError, OSError, ValueError) as e:
+            print('ERROR    %s: %s' % (skin_dir, e), file=sys.stderr)
+            return 2
+
+    tasks = [t for skin in skins for t in skin[3]]
+    boxes = {}
+    if tasks:
+        pool = multiprocessing.Pool(max(1, min(args.jobs, len(tasks))))
+        try:
+            for filepath, box in pool.imap_unordered(crop_png, tasks):
+                if box:
+                    print('CROP     %s %dx%d+%d+%d' % (filepath, box[2] - box[0],
+                                                       box[3] - box[1], box[0], box[1]))
+                    boxes[filepath] = box
+        finally:
+            pool.close()
+            pool.join()
+
+    for skin_dir, image, layers, _ in skins:
+        skin_boxes = dict((f, b) for f, b in boxes.items() if f in layers)
+        if skin_boxes:
+            skin_autocrop_layout(skin_dir, image, layers, skin_boxes)
+            print('LAYOUT   %s' % os.path.join(skin_dir, SKIN_LAYOUT_FILE))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
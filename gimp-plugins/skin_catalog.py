@@ -0,0 +1,363 @@
+#! /usr/bin/env python
+""" Index skins once, list, validate and link them from the index.
+
+Skin directories and .skin archives named ESKIN_* are found under root directories.
+Each one is indexed with its density from hardware.ini, screen and background sizes and
+buttons from layout.json, whether the pictures of its layout exist, and a content hash:
+a digest of names, crc32 and sizes of its files, the same for a skin directory and its
+archive. An entry is read again only when the stamp of the skin changes: mtime of the
+directory and of its newest file, and number of files, or size and mtime of an archive.
+
+USAGE : skin_catalog.py scan [--index catalog.json] [root ...]
+        skin_catalog.py list [--json] [root ...]
+        skin_catalog.py path <skin_dir|skin.skin|skin_name>    print a valid skin directory
+        skin_catalog.py link [--root root ...] <sdk_skins_dir> [...]
+"""
+from __future__ import print_function
+
+import os
+import re
+import sys
+import json
+import zlib
+import hashlib
+import argparse
+from collections import OrderedDict
+
+from gimp_layout import JSON_LAYOUT_FILE, LayerIndex, json as gimp_json
+from skin_layout import SKIN_LAYOUT_FILE, png_header_size
+from skin_pack import SKIN_ARCHIVE_EXTENSION, EXCLUDED_FILES, SkinArchive
+from skin_pack import skin_cache, skin_cache_dir
+
+CATALOG_FILE = 'catalog.json'
+CATALOG_VERSION = 2
+SKIN_PREFIX = 'ESKIN_'
+HARDWARE_FILE = 'hardware.ini'
+
+LAYOUT_IMAGE = re.compile(r'^\s*image\s+(\S+)', re.M)
+HARDWARE_DENSITY = re.compile(r'hw.lcd.density\W*=\W*(\d+)')
+BUTTON_NAME = re.compile(r'^(.*)_(port|land)\w*\.?.*$')
+
+
+def catalog_path():
+    return os.path.join(skin_cache_dir(), CATALOG_FILE)
+
+
+def is_skin_archive(filepath):
+    return filepath.endswith(SKIN_ARCHIVE_EXTENSION) and os.path.isfile(filepath)
+
+
+def find_skins(roots):
+    """ Returns paths of skin directories and archives under roots, skin directories are
+    not searched, nor hidden directories
+    """
+    skins = []
+    for root in roots:
+        for dirpath, dirnames, filenames in os.walk(root):
+            for name in list(dirnames):
+                if name.startswith('.'):
+                    dirnames.remove(name)
+                elif name.upper().startswith(SKIN_PREFIX):
+                    dirnames.remove(name)
+                    skins.append(os.path.abspath(os.path.join(dirpath, name)))
+            skins.extend(os.path.abspath(os.path.join(dirpath, name)) for name in filenames
+                         if name.upper().startswith(SKIN_PREFIX) and
+                         name.endswith(SKIN_ARCHIVE_EXTENSION))
+    return sorted(skins)
+
+
+def skin_name(path):
+    name = os.path.basename(path)
+    if name.endswith(SKIN_ARCHIVE_EXTENSION):
+        name = name[:-len(SKIN_ARCHIVE_EXTENSION)]
+    return name
+
+
+def skin_files(skin_dir):
+    return [n for n in sorted(os.listdir(skin_dir))
+            if n not in EXCLUDED_FILES and not n.startswith('.') and
+            os.path.isfile(os.path.join(skin_dir, n))]
+
+
+def skin_stamp(path):
+    """ Returns what changes when a skin changes, without reading its files
+    """
+    st = os.stat(path)
+    if not os.path.isdir(path):
+        return [st.st_size, st.st_mtime]
+    # Links are not followed, dangling ones left by skin_dedupe.py --symlink included
+    mtimes = [os.lstat(os.path.join(path, n)).st_mtime for n in os.listdir(path)]
+    return [st.st_mtime, max(mtimes or [0]), len(mtimes)]
+
+
+class SkinDir(object):
+    """ Files of a skin directory, with the interface of SkinArchive used by the catalog
+    """
+
+    def __init__(self, skin_dir):
+        self.skin_dir = skin_dir
+
+    def names(self):
+        return skin_files(self.skin_dir)
+
+    def read(self, name):
+        with open(os.path.join(self.skin_dir, name), 'rb') as f:
+            return f.read()
+
+    def view(self, name):
+        with open(os.path.join(self.skin_dir, name), 'rb') as f:
+            return f.read(24)
+
+    def content_hash(self):
+        h = hashlib.sha1()
+        for name in self.names():
+            data = self.read(name)
+            h.update(('%s %08x %d\n' % (name, zlib.crc32(data) & 0xffffffff,
+                                        len(data))).encode('utf-8'))
+        return h.hexdigest()
+
+
+def archive_content_hash(archive):
+    h = hashlib.sha1()
+    for info in sorted(archive.infos(), key=lambda i: i.filename):
+        if info.filename not in EXCLUDED_FILES:
+            h.update(('%s %08x %d\n' % (info.filename, info.CRC,
+                                        info.file_size)).encode('utf-8'))
+    return h.hexdigest()
+
+
+def skin_buttons(image):
+    """ Returns button names of layout.json objects, as skin_layout names them
+    """
+    index = LayerIndex(image)
+    buttons = set()
+    for group in ('portrait', 'landscape'):
+        group_layer = index.find_layer(group)
+        if group_layer is None:
+            continue
+        for layer in index.find_layers('(?!(background|screen))', group_layer):
+            match = BUTTON_NAME.match(layer.name)
+            if match:
+                buttons.add(match.group(1))
+    return sorted(buttons)
+
+
+def read_entry(path):
+    """ Returns the catalog entry of a skin directory or archive
+    """
+    entry = OrderedDict([('name', skin_name(path)), ('path', path),
+                         ('kind', os.path.isdir(path) and 'dir' or 'archive'),
+                         ('stamp', skin_stamp(path)),
+                         ('density', None), ('screen', None), ('background', None),
+                         ('buttons', []), ('hash', None), ('valid', False), ('error', None)])
+    try:
+        if entry['kind'] == 'dir':
+            skin = SkinDir(path)
+            entry['hash'] = skin.content_hash()
+            _read_skin(skin, entry)
+        else:
+            with SkinArchive(path) as skin:
+                entry['hash'] = archive_content_hash(skin)
+                _read_skin(skin, entry)
+    except (IOError, OSError, ValueError, KeyError, AttributeError) as e:
+        entry['error'] = str(e)
+    return entry
+
+
+def _read_skin(skin, entry):
+    names = set(skin.names())
+    if HARDWARE_FILE in names:
+        density = HARDWARE_DENSITY.search(skin.read(HARDWARE_FILE).decode('utf-8'))
+        entry['density'] = density and int(density.group(1))
+    for key, name in (('screen', 'screen_port.png'), ('background', 'background_port.png')):
+        if name in names:
+            # Stored members of archives are viewed, not read
+            size = png_header_size(skin.view(name)[:24])
+            entry[key] = size and list(size)
+    if JSON_LAYOUT_FILE in names:
+        # Buttons are listed when known, skins are valid without them: older layout.json
+        # formats have layers by name, which are no valid record fields
+        try:
+            image = gimp_json.loads(skin.read(JSON_LAYOUT_FILE).decode('utf-8'))
+            if isinstance(getattr(image, 'layers', None), list):
+                entry['buttons'] = skin_buttons(image)
+        except (ValueError, AttributeError):
+            pass
+
+    if SKIN_LAYOUT_FILE not in names:
+        entry['error'] = 'no %s file' % SKIN_LAYOUT_FILE
+        return
+    missing = [n for n in LAYOUT_IMAGE.findall(skin.read(SKIN_LAYOUT_FILE).decode('utf-8'))
+               if n not in names]
+    if missing:
+        entry['error'] = 'missing pictures: %s' % ' '.join(sorted(set(missing)))
+        return
+    entry['valid'] = True
+
+
+class SkinCatalog(object):
+    """ Index of skins by path, entries are read again when their skin changes
+    """
+
+    def __init__(self, index_path=None):
+        self.index_path = index_path or catalog_path()
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f, object_pairs_hook=OrderedDict)
+            self.skins = index['version'] == CATALOG_VERSION and index['skins'] or {}
+        except (IOError, ValueError, KeyError, TypeError):
+            self.skins = {}
+        self.changed = False
+
+    def entry(self, path):
+        """ Returns the entry of a skin, read again when its stamp changed
+        """
+        path = os.path.abspath(path)
+        entry = self.skins.get(path)
+        if entry is None or entry['stamp'] != skin_stamp(path):
+            entry = self.skins[path] = read_entry(path)
+            self.changed = True
+        return entry
+
+    def scan(self, roots):
+        """ Returns entries of skins under roots, entries of skins removed from roots
+        are dropped
+        """
+        paths = find_skins(roots)
+        prefixes = [os.path.join(os.path.abspath(r), '') for r in roots]
+        for path in list(self.skins):
+            if path not in paths and any(path.startswith(p) for p in prefixes):
+                del self.skins[path]
+                self.changed = True
+        return [self.entry(p) for p in paths]
+
+    def find(self, name):
+        """ Returns the entries named name, valid ones first. Entries are read again when
+        their skin changed, entries of removed skins are dropped
+        """
+        entries = []
+        for path in [p for p, e in self.skins.items() if e['name'] == name]:
+            if os.path.exists(path):
+                entries.append(self.entry(path))
+            else:
+                del self.skins[path]
+                self.changed = True
+        return sorted(entries, key=lambda e: (not e['valid'], e['kind'] != 'dir', e['path']))
+
+    def save(self):
+        if not self.changed:
+            return
+        index_dir = os.path.dirname(self.index_path)
+        if index_dir and not os.path.isdir(index_dir):
+            os.makedirs(index_dir)
+        temp = self.index_path + '.tmp'
+        with open(temp, 'w') as f:
+            json.dump(OrderedDict([('version', CATALOG_VERSION), ('skins', self.skins)]), f,
+                      indent=2, separators=(',', ': '))
+        os.rename(temp, self.index_path)
+        self.changed = False
+
+
+def skin_path(catalog, skin):
+    """ Returns the directory of a valid skin, a skin directory, a skin archive unpacked to
+    the cache, or the first valid skin of the catalog named skin, the current directory
+    is indexed when the catalog has none
+    """
+    if os.path.isdir(skin) or is_skin_archive(skin):
+        entries = [catalog.entry(skin)]
+    else:
+        entries = catalog.find(skin_name(skin))
+        if not entries:
+            # Not indexed yet
+            catalog.scan(['.'])
+            entries = catalog.find(skin_name(skin))
+        if not entries:
+            raise ValueError('unknown skin: %s' % skin)
+    entry = entries[0]
+    if not entry['valid']:
+        raise ValueError('invalid skin %s: %s' % (entry['path'], entry['error']))
+    if entry['kind'] == 'archive':
+        return skin_cache(entry['path'])
+    return entry['path']
+
+
+def link_skins(entries, skins_dirs):
+    """ Replace ESKIN_* links of skins_dirs with links to valid skins, a skin directory
+    is linked rather than the archive of the same name
+    """
+    targets = OrderedDict()
+    for entry in sorted(entries, key=lambda e: (e['kind'] != 'dir', e['path'])):
+        if not entry['valid']:
+            print('INVALID  %s: %s' % (entry['path'], entry['error']))
+        elif entry['name'] not in targets:
+            targets[entry['name']] = entry['kind'] == 'archive' and \
+                skin_cache(entry['path']) or entry['path']
+    for skins_dir in skins_dirs:
+        if not os.path.isdir(skins_dir):
+            print('SKIP     %s: not a directory' % skins_dir)
+            continue
+        for name in sorted(os.listdir(skins_dir)):
+            link = os.path.join(skins_dir, name)
+            if name.upper().startswith(SKIN_PREFIX) and os.path.islink(link):
+                print('UNLINK   %s' % link)
+                os.remove(link)
+        for name, target in targets.items():
+            link = os.path.join(skins_dir, name)
+            print('LINK     %s -> %s' % (link, target))
+            os.symlink(target, link)
+
+
+def format_entry(entry):
+    size = lambda s: s and '%dx%d' % tuple(s) or '-'
+    return '%-24s %-7s %5s %-10s %-10s %-8s %s' % (
+        entry['name'], entry['kind'], entry['density'] or '-', size(entry['screen']),
+        size(entry['background']), entry['valid'] and 'valid' or 'INVALID',
+        ' '.join(entry['buttons']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Index, list, validate and link skins')
+    parser.add_argument('--index', help='catalog file, %s by default' % catalog_path())
+    commands = parser.add_subparsers(dest='command')
+    scan = commands.add_parser('scan', help='index skins under roots')
+    scan.add_argument('roots', nargs='*', default=['.'], metavar='root')
+    listing = commands.add_parser('list', help='list skins under roots')
+    listing.add_argument('--json', action='store_true', help='print entries as json')
+    listing.add_argument('roots', nargs='*', default=['.'], metavar='root')
+    path = commands.add_parser('path', help='print the directory of a valid skin')
+    path.add_argument('skin')
+    link = commands.add_parser('link', help='link valid skins to sdk skins directories')
+    link.add_argument('--root', action='append', dest='roots', metavar='root',
+                      help='directory searched for skins, the current one by default')
+    link.add_argument('skins_dirs', nargs='+', metavar='sdk_skins_dir')
+    args = parser.parse_args(argv)
+
+    catalog = SkinCatalog(args.index)
+    try:
+        if args.command == 'scan':
+            for entry in catalog.scan(args.roots):
+                print('%s %s' % (entry['valid'] and 'SKIN    ' or 'INVALID ', entry['path']))
+        elif args.command == 'list':
+            entries = catalog.scan(args.roots)
+            if args.json:
+                print(json.dumps(entries, indent=2, separators=(',', ': ')))
+            else:
+                for entry in entries:
+                    print(format_entry(entry))
+        elif args.command == 'path':
+            print(skin_path(catalog, args.skin))
+        elif args.command == 'link':
+            link_skins(catalog.scan(args.roots or ['.']), args.skins_dirs)
+        else:
+            parser.print_usage()
+            return 1
+    except (IOError, OSError, ValueError) as e:
+        print('ERROR    %s' % e, file=sys.stderr)
+        return 2
+    finally:
+        catalog.save()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,147 @@
+#! /usr/bin/env python
+""" Replace identical pictures of exported skins with links to a single file.
+
+Pictures are compared by a hash of their decoded pixels, computed in a pool of processes.
+Duplicates are replaced with hardlinks, or relative symlinks with --symlink, to the
+smallest file. Pictures identical after a rotation, like _port/_land pairs, are reported.
+Without skin_dir, all ESKIN_* directories of the current directory are deduplicated.
+
+USAGE : skin_dedupe.py [-j workers] [-n] [--symlink] [<skin_dir> ...]
+"""
+from __future__ import print_function
+
+import os
+import sys
+import glob
+import hashlib
+import argparse
+import multiprocessing
+
+from gimp_layout import gimp_import_manifest, gimp_export_manifest
+from skin_layout import is_png
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+def pixels_hash(image):
+    return hashlib.sha1(repr((image.mode, image.size)).encode('ascii') +
+                        image.tobytes()).hexdigest()
+
+
+def hash_png(filepath):
+    """ Returns (filepath, pixels hash, pixels hash of the picture rotated by 90 degrees)
+    """
+    image = Image.open(filepath)
+    image.load()
+    return filepath, pixels_hash(image), pixels_hash(image.transpose(Image.ROTATE_90))
+
+
+def skin_pictures(skin_dirs):
+    """ Returns png files of skin directories, symlinks excluded
+    """
+    filepaths = []
+    for skin_dir in skin_dirs:
+        for name in sorted(os.listdir(skin_dir)):
+            filepath = os.path.join(skin_dir, name)
+            if os.path.isfile(filepath) and not os.path.islink(filepath) and is_png(filepath):
+                filepaths.append(filepath)
+    return filepaths
+
+
+def link_file(target, filepath, symlink=False):
+    """ Replace filepath with a link to target, through a temporary link
+    """
+    temp = filepath + '.tmp'
+    if symlink:
+        os.symlink(os.path.relpath(target, os.path.dirname(filepath)), temp)
+    else:
+        os.link(target, temp)
+    os.rename(temp, filepath)
+
+
+def update_manifest(filepath):
+    """ Update the size of filepath in the manifest of the incremental export,
+    so that the next export does not write the picture again
+    """
+    save_path, name = os.path.split(filepath)
+    manifest = gimp_import_manifest(save_path)
+    if name in manifest:
+        manifest[name]['size'] = os.path.getsize(filepath)
+        gimp_export_manifest(save_path, manifest)
+
+
+def dedupe(hashes, symlink=False, dry_run=False):
+    """ Link files with identical pixels, hashes are (filepath, hash, rotated hash) tuples.
+    Returns the number of bytes saved
+    """
+    groups = {}
+    for filepath, pixels, rotated in hashes:
+        groups.setdefault(pixels, []).append(filepath)
+
+    saved = 0
+    for pixels, filepaths in sorted(groups.items(), key=lambda g: sorted(g[1])):
+        # Smallest encoding is kept
+        filepaths.sort(key=lambda f: (os.path.getsize(f), f))
+        target = filepaths[0]
+        for filepath in filepaths[1:]:
+            if os.path.samefile(target, filepath):
+                continue
+            if os.stat(filepath).st_nlink == 1:
+                # Files with other hardlinks are not freed
+                saved += os.path.getsize(filepath)
+            print('LINK     %s -> %s' % (filepath, target))
+            if not dry_run:
+                link_file(target, filepath, symlink)
+                update_manifest(filepath)
+
+    reported = set()
+    for filepath, pixels, rotated in hashes:
+        pair = frozenset((pixels, rotated))
+        if rotated != pixels and rotated in groups and pair not in reported:
+            reported.add(pair)
+            print('ROTATED  %s %s' % (' '.join(sorted(groups[pixels])),
+                                      ' '.join(sorted(groups[rotated]))))
+    return saved
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Link identical pictures of skins')
+    parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(),
+                        help='number of worker processes, one per core by default')
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help='only print duplicates')
+    parser.add_argument('--symlink', action='store_true',
+                        help='link with relative symlinks instead of hardlinks')
+    parser.add_argument('skin_dirs', nargs='*', metavar='skin_dir')
+    args = parser.parse_args(argv)
+
+    if Image is None:
+        print('ERROR    Pillow is required: pip install Pillow', file=sys.stderr)
+        return 2
+
+    skin_dirs = args.skin_dirs or sorted(d for d in glob.glob('ESKIN_*') if os.path.isdir(d))
+    try:
+        filepaths = skin_pictures(skin_dirs)
+    except (IOError, OSError) as e:
+        print('ERROR    %s' % e, file=sys.stderr)
+        return 2
+
+    hashes = []
+    if filepaths:
+        pool = multiprocessing.Pool(max(1, min(args.jobs, len(filepaths))))
+        try:
+            hashes = sorted(pool.imap_unordered(hash_png, filepaths))
+        finally:
+            pool.close()
+            pool.join()
+
+    saved = dedupe(hashes, args.symlink, args.dry_run)
+    print('SAVED    %d bytes%s' % (saved, args.dry_run and ' (dry run)' or ''))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
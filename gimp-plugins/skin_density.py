@@ -0,0 +1,183 @@
+#! /usr/bin/env python
+""" Derive density variants of exported skins, without Gimp.
+
+Png files are resampled with Pillow in a pool of processes, offsets and sizes are
+scaled in layout.json and layout, and hw.lcd.density is updated in hardware.ini.
+Each density is written to <skin_dir>_<density>, like the Gimp plugin does.
+
+USAGE : skin_density.py [-j workers] <skin_dir> <density> [...]
+"""
+from __future__ import print_function
+
+import os
+import re
+import sys
+import shutil
+import argparse
+import multiprocessing
+
+from gimp_layout import JSON_LAYOUT_FILE, JSON_MANIFEST_FILE, load_layout_dict, dump_layout_dict
+from skin_layout import SKIN_LAYOUT_FILE, SKIN_STAMP_FILE, DENSITIES
+from skin_layout import density_scale, skin_layout, skin_import_json, png_size, is_png
+from export_stats import STATS_FILE
+from png_encode import save_image
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+HARDWARE_FILE = 'hardware.ini'
+
+# Files describing the skin, rewritten rather than copied
+SKIN_FILES = (JSON_LAYOUT_FILE, SKIN_LAYOUT_FILE, HARDWARE_FILE, JSON_MANIFEST_FILE,
+              STATS_FILE, SKIN_STAMP_FILE)
+
+LAYOUT_NUMBER = re.compile(r'^(\s*(width|height|x|y)\s+)(-?\d+)', re.MULTILINE)
+
+
+def scale_bounds(offset, size, factor):
+    """ Returns scaled (offset, size), keeping edges on the same pixels as Gimp does
+    """
+    scaled_offset = int(round(offset * factor))
+    return scaled_offset, max(1, int(round((offset + size) * factor)) - scaled_offset)
+
+
+def scale_layer(layer, factors, sizes):
+    """ Scale sizes and offsets of a layout.json layer and its sub-layers in place.
+    Scaled sizes are collected into sizes by layer name
+    """
+    offsets = layer.get('offsets') or (0, 0)
+    x, width = scale_bounds(offsets[0], layer['width'], factors[0])
+    y, height = scale_bounds(offsets[1], layer['height'], factors[1])
+    layer['width'], layer['height'] = width, height
+    if 'offsets' in layer:
+        layer['offsets'] = [x, y]
+    sizes.setdefault(layer['name'], (width, height))
+    if layer.get('mask'):
+        scale_layer(layer['mask'], factors, sizes)
+    for sub_layer in layer.get('layers', ()):
+        scale_layer(sub_layer, factors, sizes)
+
+
+def scale_layout(layout, factors):
+    """ Returns layout file content with sizes and positions scaled
+    """
+    def scale(match):
+        factor = factors[match.group(2) in ('width', 'x') and 0 or 1]
+        return '%s%d' % (match.group(1), int(round(int(match.group(3)) * factor)))
+
+    return LAYOUT_NUMBER.sub(scale, layout)
+
+
+def resample_png(args):
+    """ Resample a png file to size, returns the target file path
+    """
+    source, target, size = args
+    image = Image.open(source)
+    image.load()
+    if image.size != size:
+        # Resample with premultiplied alpha, as Gimp does
+        mode = image.mode
+        if mode in ('RGBA', 'LA'):
+            image = image.convert(mode == 'RGBA' and 'RGBa' or 'La')
+        image = image.resize(size, Image.BICUBIC)
+        if image.mode != mode:
+            image = image.convert(mode)
+    save_image(image, target)
+    return target
+
+
+def skin_density_tasks(skin_dir, target_dir, target_density):
+    """ Write layout.json, layout and hardware.ini of target_dir, copy other files.
+    Returns the list of (source, target, size) png resampling tasks
+    """
+    with open(os.path.join(skin_dir, HARDWARE_FILE), 'r') as f:
+        scale, hardware_config = density_scale(f.read(), target_density)
+    with open(os.path.join(skin_dir, JSON_LAYOUT_FILE), 'r') as f:
+        image = load_layout_dict(f)
+    if not isinstance(image.get('layers'), list):
+        raise ValueError('unsupported %s format' % JSON_LAYOUT_FILE)
+    with open(os.path.join(skin_dir, SKIN_LAYOUT_FILE), 'r') as f:
+        layout = f.read()
+
+    # Image is scaled as pdb.gimp_image_scale does, layers relative to its new size
+    width, height = int(round(scale * image['width'])), int(round(scale * image['height']))
+    factors = float(width) / image['width'], float(height) / image['height']
+    image['width'], image['height'] = width, height
+    sizes = {}
+    for layer in image['layers']:
+        scale_layer(layer, factors, sizes)
+
+    if not os.path.isdir(target_dir):
+        os.makedirs(target_dir)
+    with open(os.path.join(target_dir, HARDWARE_FILE), 'w') as f:
+        f.write(hardware_config)
+    with open(os.path.join(target_dir, JSON_LAYOUT_FILE), 'w') as f:
+        dump_layout_dict(image, f)
+
+    tasks = []
+    for name in sorted(os.listdir(skin_dir)):
+        source, target = os.path.join(skin_dir, name), os.path.join(target_dir, name)
+        if name in SKIN_FILES or not os.path.isfile(source):
+            continue
+        if is_png(source):
+            size = sizes.get(name) or tuple(max(1, int(round(s * f)))
+                                            for s, f in zip(png_size(source), factors))
+            tasks.append((source, target, size))
+        else:
+            shutil.copyfile(source, target)
+
+    # A layout generated from layout.json is generated again, edited ones are scaled
+    try:
+        generated = skin_layout(skin_import_json(skin_dir)) == layout
+    except Exception:
+        generated = False
+    if generated:
+        layout = skin_layout(skin_import_json(target_dir))
+    else:
+        layout = scale_layout(layout, factors)
+    with open(os.path.join(target_dir, SKIN_LAYOUT_FILE), 'w') as f:
+        f.write(layout)
+
+    return tasks
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Derive density variants of exported skins')
+    parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(),
+                        help='number of worker processes, one per core by default')
+    parser.add_argument('skin_dir')
+    parser.add_argument('densities', nargs='+', metavar='density',
+                        choices=[d[0] for d in DENSITIES[1:]])
+    args = parser.parse_args(argv)
+
+    if Image is None:
+        print('ERROR    Pillow is required: pip install Pillow', file=sys.stderr)
+        return 2
+
+    skin_dir = os.path.normpath(args.skin_dir)
+    tasks = []
+    for density in args.densities:
+        target_dir = '%s_%s' % (skin_dir, density)
+        try:
+            tasks.extend(skin_density_tasks(skin_dir, target_dir, density))
+        except (IOError, OSError, ValueError, IndexError) as e:
+            print('ERROR    %s: %s' % (skin_dir, e), file=sys.stderr)
+            return 2
+        print('SKIN     %s (%s)' % (target_dir, density))
+
+    # Biggest pictures first, to balance workers
+    tasks.sort(key=lambda t: -t[2][0] * t[2][1])
+    pool = multiprocessing.Pool(max(1, min(args.jobs, len(tasks))))
+    try:
+        for target in pool.imap_unordered(resample_png, tasks):
+            print('PNG      %s' % target)
+    finally:
+        pool.close()
+        pool.join()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,323 @@
+#! /usr/bin/env python
+""" Write the Android emulator `layout` file of exported skins, without Gimp.
+
+Layer offsets are read from layout.json, sizes of png layers from their IHDR chunk.
+
+USAGE : skin_layout.py [--check] <skin_dir> [...]
+"""
+from __future__ import print_function
+
+import os
+import re
+import sys
+import struct
+import argparse
+from string import Template
+from collections import OrderedDict
+
+from gimp_layout import json, LayerIndex, JSON_LAYOUT_FILE, load_layout_dict
+
+SKIN_LAYOUT_FILE = 'layout'
+
+# Stamp of the xcf file a skin was exported from, to skip unchanged exports
+SKIN_STAMP_FILE = 'layout.stamp'
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+DENSITIES = (
+    # name, (density, min, max)
+    ('DEFAULT', (0, 0, 0)),
+    ('ldpi', (120, 120, 139)),
+    ('mdpi', (160, 140, 199)),
+    ('hdpi', (240, 200, 279)),
+    ('xhdpi', (320, 280, 399)),
+    ('xxhdpi', (480, 400, 559)),
+    ('xxxhdpi', (640, 560, 719))
+    )
+DENSITIES_MAP = dict(DENSITIES)
+SKIN_RATIOS = ('DEFAULT', '4/3', '16/9')
+
+LAYOUT = Template("""
+parts {
+   device {
+        display {
+            width   ${screen_port_width}
+            height  ${screen_port_height}
+            x       0
+            y       0
+        }
+    }
+    
+    portrait {
+        background {
+            image   background_port.png
+        }
+
+        buttons {
+            ${buttons_port}
+        }
+    }
+    
+    landscape {
+        background {
+            image   background_land.png
+        }
+
+        buttons {
+            ${buttons_land}
+        }
+    }
+}
+
+layouts {
+    portrait {
+        width     ${background_port_width}
+        height    ${background_port_height} 
+        color     0x555555
+        
+        part1 {
+            name    portrait
+            x       0
+            y       0
+        }
+
+        part2 {
+            name    device
+            x       $screen_port_x
+            y       $screen_port_y
+        }
+    }
+    
+    landscape {
+        width     ${background_land_width}
+        height    ${background_land_height}
+        color     0x555555
+        
+        part1 {
+            name    landscape
+            x       0
+            y       0
+        }
+
+        part2 {
+            name   device
+            x      $screen_land_x
+            y      $screen_land_y
+            rotation 3
+        }
+    }
+}
+
+""")
+
+BUTTON = Template("""
+            ${button_name} {
+                image   ${button_name}_${orientation}.png
+                x       ${button_x}
+                y       ${button_y}
+            }""")
+
+# Blocks, block ends and words of `layout` files
+LAYOUT_TOKEN = re.compile(r'[{}]|[^\s{}]+')
+
+# Names of button layers, <key>_port.png or <key>_land.png
+BUTTON_NAME = re.compile(r'^(.*)_(\w*)\.?.*$')
+
+
+class LayerNameError(Exception):
+    pass
+
+
+def png_header_size(header):
+    """ Returns (width, height) read from the first 24 bytes of a png file, None if they
+    are not the ones of a png file
+    """
+    header = bytes(header[:24])
+    if header[:8] != PNG_SIGNATURE or header[12:16] != b'IHDR':
+        return None
+    return struct.unpack('>II', header[16:24])
+
+
+def png_size(filepath):
+    """ Returns (width, height) read from png IHDR chunk, None if file is not a png
+    """
+    with open(filepath, 'rb') as f:
+        return png_header_size(f.read(24))
+
+
+def is_png(filepath):
+    with open(filepath, 'rb') as f:
+        return f.read(len(PNG_SIGNATURE)) == PNG_SIGNATURE
+
+
+def parse_layout(content):
+    """ Returns the tree of a `layout` file: blocks as OrderedDicts, values as strings
+    """
+    tokens = LAYOUT_TOKEN.findall(content)
+    root = OrderedDict()
+    blocks = [root]
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        following = i + 1 < len(tokens) and tokens[i + 1] or None
+        if token == '}':
+            if len(blocks) == 1:
+                raise ValueError('unexpected } in %s' % SKIN_LAYOUT_FILE)
+            blocks.pop()
+            i += 1
+        elif token == '{' or following is None or following == '}':
+            raise ValueError('unexpected %s in %s' % (token, SKIN_LAYOUT_FILE))
+        elif following == '{':
+            block = blocks[-1][token] = OrderedDict()
+            blocks.append(block)
+            i += 2
+        else:
+            blocks[-1][token] = following
+            i += 2
+    if len(blocks) > 1:
+        raise ValueError('unclosed block in %s' % SKIN_LAYOUT_FILE)
+    return root
+
+
+def density_scale(hardware_config, target_density):
+    """ Returns the scale factor from hw.lcd.density of hardware_config to target_density,
+    and hardware_config updated with the scaled density
+    """
+    skin_density = int(re.findall(r'hw.lcd.density\W*=\W*(\d*).*', hardware_config)[0])
+    ref_skin_density = [d[0] for d in DENSITIES_MAP.values()
+                        if skin_density in range(d[1], d[2])][0]
+    target_density_value = DENSITIES_MAP.get(target_density)[0]
+    scale = float(target_density_value) / ref_skin_density
+    hardware_config_scaled = re.sub(r'(.*hw.lcd.density\W*=\W*)(\d*)(.*)',
+                                    '\\g<1>%d\\g<3>' % int(scale * skin_density), hardware_config)
+    return scale, hardware_config_scaled
+
+
+def layer_size(layer):
+    return layer.width, layer.height
+
+
+def skin_layout(image, size=layer_size, index=None):
+    """ Returns `layout` file content for image, a Gimp image or layout.json objects.
+    size(layer) returns the (width, height) of a layer
+    """
+    index = index or LayerIndex(image)
+    port_layers = index.find_layer('portrait')
+    land_layers = index.find_layer('landscape')
+    screen_port = index.find_layer('screen_port.png', port_layers)
+    screen_land = index.find_layer('screen_land.png', land_layers)
+    background_port = index.find_layer('background_port.png', port_layers)
+    background_land = index.find_layer('background_land.png', land_layers)
+
+    skin_layout = {}
+    skin_layout['screen_port_width'], skin_layout['screen_port_height'] = size(screen_port)
+    skin_layout['background_port_width'], skin_layout['background_port_height'] = \
+        size(background_port)
+    skin_layout['background_land_width'], skin_layout['background_land_height'] = \
+        size(background_land)
+
+    skin_layout['screen_port_x'] = screen_port.offsets[0] - background_port.offsets[0]
+    skin_layout['screen_port_y'] = screen_port.offsets[1] - background_port.offsets[1]
+    skin_layout['screen_land_x'] = screen_land.offsets[0] - background_land.offsets[0]
+    skin_layout['screen_land_y'] = screen_land.offsets[1] - background_land.offsets[1] + \
+        size(screen_land)[1]
+
+    button_layers = index.find_layers('(?!(background|screen))', port_layers) + \
+        index.find_layers('(?!(background|screen))', land_layers)
+
+    buttons = dict(land=[], port=[])
+
+    for layer in button_layers:
+        try:
+            button_name, orientation = BUTTON_NAME.findall(layer.name)[0]
+            orientation = orientation[:4].lower()
+            background_layer = orientation == 'port' and background_port or background_land
+            buttons[orientation].append(BUTTON.substitute({
+                'button_name': button_name,
+                'orientation': orientation,
+                'button_x': layer.offsets[0] - background_layer.offsets[0],
+                'button_y': layer.offsets[1] - background_layer.offsets[1]}))
+        except (IndexError, KeyError) as e:
+            raise LayerNameError(e, """Cannot identify button layer with name: \n"%s"\n\n\
+Name must be like: "<button_key>_port.png" or "<button_key>_land.png".\n\n""" % layer.name)
+
+    skin_layout['buttons_port'] = ''.join(buttons['port'])
+    skin_layout['buttons_land'] = ''.join(buttons['land'])
+
+    return LAYOUT.substitute(skin_layout)
+
+
+def skin_export_layout(image, save_path, index=None):
+    layout_filepath = os.path.join(save_path, SKIN_LAYOUT_FILE)
+    with open(layout_filepath, 'w') as f:
+        f.write(skin_layout(image, index=index))
+
+
+def skin_import_json(skin_dir):
+    """ Returns layout.json objects of skin_dir
+    """
+    with open(os.path.join(skin_dir, JSON_LAYOUT_FILE), 'r') as f:
+        try:
+            image = json.load(f)
+        except ValueError:
+            image = None
+    if not isinstance(getattr(image, 'layers', None), list):
+        raise ValueError('unsupported %s format' % JSON_LAYOUT_FILE)
+    return image
+
+
+def is_older_layout_json(skin_dir):
+    """ Tells layout.json files of the older format, with layers by name
+    """
+    try:
+        with open(os.path.join(skin_dir, JSON_LAYOUT_FILE), 'r') as f:
+            return isinstance(load_layout_dict(f).get('layers'), dict)
+    except (IOError, OSError, ValueError, AttributeError):
+        return False
+
+
+def skin_dir_layout(skin_dir):
+    """ Returns `layout` file content for an exported skin directory
+    """
+    def size(layer):
+        filepath = os.path.join(skin_dir, layer.name)
+        return os.path.isfile(filepath) and png_size(filepath) or layer_size(layer)
+
+    return skin_layout(skin_import_json(skin_dir), size)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write the emulator layout file of skins')
+    parser.add_argument('--check', action='store_true',
+                        help='only check that layout files are up to date')
+    parser.add_argument('skin_dirs', nargs='+', metavar='skin_dir')
+    args = parser.parse_args(argv)
+
+    status = 0
+    for skin_dir in args.skin_dirs:
+        layout_filepath = os.path.join(skin_dir, SKIN_LAYOUT_FILE)
+        try:
+            layout = skin_dir_layout(skin_dir)
+        except (IOError, OSError, ValueError, AttributeError, LayerNameError) as e:
+            print('ERROR    %s: %s' % (skin_dir, e), file=sys.stderr)
+            status = 2
+            continue
+
+        if args.check:
+            try:
+                with open(layout_filepath, 'r') as f:
+                    up_to_date = f.read() == layout
+            except IOError:
+                up_to_date = False
+            if not up_to_date:
+                print('OUTDATED %s' % layout_filepath)
+                status = status or 1
+        else:
+            with open(layout_filepath, 'w') as f:
+                f.write(layout)
+            print('LAYOUT   %s' % layout_filepath)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
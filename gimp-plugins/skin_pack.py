@@ -0,0 +1,232 @@
+#! /usr/bin/env python
+""" Pack exported skins into single archives, unpack them, or unpack them to a cache.
+
+Archives are zip files: png files, already compressed, are stored as they are, text
+files are deflated. The zip central directory indexes members, each member has its
+crc32. Archives are reproducible, members are sorted and dated 1980-01-01. Unpacking
+replaces the members of the archive a directory was unpacked from, other files are
+kept, and directories that were not unpacked from an archive must be empty.
+
+USAGE : skin_pack.py pack <skin_dir> [-o skin.skin]
+        skin_pack.py unpack <skin.skin> [-o skin_dir]
+        skin_pack.py list <skin.skin>
+        skin_pack.py cache <skin.skin>    unpack if changed, print the cached skin_dir
+"""
+from __future__ import print_function
+
+import os
+import sys
+import mmap
+import struct
+import zipfile
+import argparse
+
+from gimp_layout import JSON_MANIFEST_FILE
+from skin_layout import SKIN_STAMP_FILE, is_png
+from export_stats import STATS_FILE
+
+SKIN_ARCHIVE_EXTENSION = '.skin'
+
+# Export bookkeeping, not part of the skin
+EXCLUDED_FILES = (JSON_MANIFEST_FILE, STATS_FILE, SKIN_STAMP_FILE)
+
+# Unpacked archive: size and mtime of the archive it was unpacked from, then the
+# names of its members, one per line
+ARCHIVE_STAMP_FILE = '.skin_archive'
+
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+ZIP_LOCAL_HEADER = struct.Struct('<4s5H3I2H')
+
+
+def skin_cache_dir():
+    return os.path.join(os.environ.get('XDG_CACHE_HOME') or
+                        os.path.join(os.path.expanduser('~'), '.cache'), 'android-skins')
+
+
+class SkinArchive(object):
+    """ Read access to a skin archive, members are read lazily, stored members can be
+    viewed in a memory map of the archive without copy
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._file = open(filepath, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._zip = zipfile.ZipFile(self._file)
+        except (ValueError, zipfile.BadZipfile):
+            self._file.close()
+            raise ValueError('not a skin archive: %s' % filepath)
+        for name in self._zip.namelist():
+            if os.path.basename(name) != name or name.startswith('.'):
+                self.close()
+                raise ValueError('unsafe member name in %s: %r' % (filepath, name))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._zip.close()
+        self._map.close()
+        self._file.close()
+
+    def names(self):
+        return self._zip.namelist()
+
+    def infos(self):
+        return self._zip.infolist()
+
+    def read(self, name):
+        """ Returns member content, checked against its crc32
+        """
+        return self._zip.read(name)
+
+    def view(self, name):
+        """ Returns a view of a stored member in the memory map, without copy or crc32 check.
+        Views must be released before the archive is closed
+        """
+        info = self._zip.getinfo(name)
+        if info.compress_type != zipfile.ZIP_STORED:
+            return self.read(name)
+        header = ZIP_LOCAL_HEADER.unpack_from(self._map, info.header_offset)
+        start = info.header_offset + ZIP_LOCAL_HEADER.size + header[-2] + header[-1]
+        try:
+            return memoryview(self._map)[start:start + info.file_size]
+        except TypeError:
+            # Python 2 memory maps have no buffer interface
+            return self._map[start:start + info.file_size]
+
+    def verify(self):
+        """ Returns the name of the first member with a wrong crc32, None if all are right
+        """
+        return self._zip.testzip()
+
+    def extract(self, skin_dir):
+        if not os.path.isdir(skin_dir):
+            os.makedirs(skin_dir)
+        for name in self.names():
+            filepath = os.path.join(skin_dir, name)
+            with open(filepath + '.tmp', 'wb') as f:
+                f.write(self.read(name))
+            os.rename(filepath + '.tmp', filepath)
+
+
+def skin_pack(skin_dir, archive_path):
+    """ Write the files of skin_dir to archive_path, returns the number of members
+    """
+    names = [n for n in sorted(os.listdir(skin_dir))
+             if n not in EXCLUDED_FILES and not n.startswith('.') and
+             os.path.isfile(os.path.join(skin_dir, n))]
+    temp = archive_path + '.tmp'
+    with zipfile.ZipFile(temp, 'w') as archive:
+        for name in names:
+            filepath = os.path.join(skin_dir, name)
+            info = zipfile.ZipInfo(name, ZIP_DATE_TIME)
+            info.external_attr = 0o644 << 16
+            info.compress_type = zipfile.ZIP_STORED if is_png(filepath) else zipfile.ZIP_DEFLATED
+            with open(filepath, 'rb') as f:
+                archive.writestr(info, f.read())
+    os.rename(temp, archive_path)
+    return len(names)
+
+
+def archive_stamp(archive_path):
+    st = os.stat(archive_path)
+    return '%d %d' % (st.st_size, int(st.st_mtime))
+
+
+def read_archive_stamp(skin_dir):
+    """ Returns the stamp of the archive skin_dir was unpacked from and the names of its
+    members, (None, None) if skin_dir was not unpacked from an archive
+    """
+    try:
+        with open(os.path.join(skin_dir, ARCHIVE_STAMP_FILE), 'r') as f:
+            lines = f.read().splitlines()
+    except IOError:
+        return None, None
+    return lines and lines[0] or '', lines[1:]
+
+
+def skin_unpack(archive_path, skin_dir):
+    """ Extract archive_path to skin_dir, replacing the members of the archive it was
+    unpacked from. Other directories are only unpacked to when empty
+    """
+    stamp, old_names = read_archive_stamp(skin_dir)
+    if stamp is None and os.path.isdir(skin_dir) and os.listdir(skin_dir):
+        raise ValueError('%s is not empty and not unpacked from an archive' % skin_dir)
+    with SkinArchive(archive_path) as archive:
+        bad_member = archive.verify()
+        if bad_member:
+            raise ValueError('bad crc32 of %s in %s' % (bad_member, archive_path))
+        names = archive.names()
+        for name in set(old_names or ()) - set(names):
+            filepath = os.path.join(skin_dir, name)
+            if os.path.basename(name) == name and os.path.isfile(filepath):
+                os.remove(filepath)
+        archive.extract(skin_dir)
+    with open(os.path.join(skin_dir, ARCHIVE_STAMP_FILE), 'w') as f:
+        f.write('\n'.join([archive_stamp(archive_path)] + names) + '\n')
+
+
+def skin_cache(archive_path, cache_dir=None):
+    """ Returns the directory archive_path is unpacked to in the cache, unpacked again
+    when the archive has changed
+    """
+    name = os.path.basename(archive_path)
+    if name.endswith(SKIN_ARCHIVE_EXTENSION):
+        name = name[:-len(SKIN_ARCHIVE_EXTENSION)]
+    skin_dir = os.path.join(cache_dir or skin_cache_dir(), name)
+    if read_archive_stamp(skin_dir)[0] != archive_stamp(archive_path):
+        skin_unpack(archive_path, skin_dir)
+    return skin_dir
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Pack, unpack and cache skin archives')
+    commands = parser.add_subparsers(dest='command')
+    pack = commands.add_parser('pack', help='pack a skin directory')
+    pack.add_argument('skin_dir')
+    pack.add_argument('-o', '--output', help='archive path, <skin_dir>.skin by default')
+    unpack = commands.add_parser('unpack', help='unpack a skin archive')
+    unpack.add_argument('archive')
+    unpack.add_argument('-o', '--output', help='skin directory, archive path without .skin by default')
+    listing = commands.add_parser('list', help='list members of a skin archive')
+    listing.add_argument('archive')
+    cache = commands.add_parser('cache', help='unpack a skin archive to the cache if changed, '
+                                              'print the skin directory')
+    cache.add_argument('archive')
+    cache.add_argument('--cache-dir', help='cache directory, %s by default' % skin_cache_dir())
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'pack':
+            skin_dir = os.path.normpath(args.skin_dir)
+            archive_path = args.output or skin_dir + SKIN_ARCHIVE_EXTENSION
+            count = skin_pack(skin_dir, archive_path)
+            print('PACK     %s (%d files)' % (archive_path, count))
+        elif args.command == 'unpack':
+            skin_dir = args.output or os.path.splitext(args.archive)[0]
+            skin_unpack(args.archive, skin_dir)
+            print('UNPACK   %s' % skin_dir)
+        elif args.command == 'list':
+            with SkinArchive(args.archive) as archive:
+                for info in archive.infos():
+                    print('%10d %08x %s %s' % (info.file_size, info.CRC,
+                                               info.compress_type and 'deflated' or 'stored  ',
+                                               info.filename))
+        elif args.command == 'cache':
+            print(skin_cache(args.archive, args.cache_dir))
+        else:
+            parser.print_usage()
+            return 1
+    except (IOError, OSError, ValueError) as e:
+        print('ERROR    %s' % e, file=sys.stderr)
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
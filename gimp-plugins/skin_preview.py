@@ -0,0 +1,249 @@
+#! /usr/bin/env python
+""" Render previews of exported skins, without Gimp or the emulator.
+
+Layers of the portrait and landscape groups of layout.json are composited with NumPy
+from the bottom up, over the size of the background layer, with the opacity and
+visibility of each layer. The screen layer is replaced by a placeholder at the
+screen position of the layout. Layers are composited in normal mode, masks saved
+with the layers are applied.
+
+Skins are rendered in a pool of processes, all ESKIN_* directories by default.
+Skins with a layout.json of the older format, with layers by name, are skipped.
+Decoded layers are cached by each process, pictures shared by skins are read once.
+With --diff, previews are compared to the ones of a reference directory, pictures
+of changed pixels are written next to the previews and the exit status is 1.
+
+USAGE : skin_preview.py [-j workers] [-o output_dir] [--diff reference_dir] [skin_dir ...]
+"""
+from __future__ import print_function
+
+import os
+import sys
+import glob
+import argparse
+import multiprocessing
+from collections import OrderedDict
+
+from skin_layout import skin_import_json, is_older_layout_json, is_png
+from gimp_layout import LayerIndex, JSON_LAYOUT_FILE
+from png_encode import PNG_PROFILE_ENV, save_image
+
+try:
+    import numpy
+    from PIL import Image
+except ImportError:
+    numpy, Image = None, None
+
+ORIENTATIONS = (('portrait', 'port'), ('landscape', 'land'))
+
+# RGBA of the screen placeholder, the color of the emulator layouts
+SCREEN_COLOR = (0x55, 0x55, 0x55, 0xff)
+# Changed pixels of diff pictures, over the dimmed reference
+DIFF_COLOR = (0xff, 0x00, 0x00, 0xff)
+
+# Decoded layers kept by each process
+CACHE_SIZE = 64
+
+# Previews are compared, not shipped: fast compression unless a profile is selected
+PREVIEW_PNG_PROFILE = 'fast'
+
+_picture_cache = OrderedDict()
+
+
+def file_key(filepath):
+    """ Returns the identity of a file, hard links made by skin_dedupe.py share it
+    """
+    stat = os.stat(filepath)
+    return stat.st_dev, stat.st_ino, stat.st_mtime, stat.st_size
+
+
+def layer_pixels(skin_dir, layer):
+    """ Returns premultiplied float RGBA pixels of a layer with its mask and opacity,
+    None when the layer has no png file. Pixels are cached by files and opacity
+    """
+    filepath = os.path.join(skin_dir, layer.name)
+    if not os.path.isfile(filepath) or not is_png(filepath):
+        return None
+    opacity = getattr(layer, 'opacity', 100.0) / 100.0
+    mask = getattr(layer, 'mask', None)
+    mask_filepath = mask and os.path.join(skin_dir, mask.name)
+    if not (mask_filepath and os.path.isfile(mask_filepath) and is_png(mask_filepath)):
+        mask_filepath = None
+    key = (file_key(filepath), mask_filepath and file_key(mask_filepath), opacity)
+    pixels = _picture_cache.pop(key, None)
+    if pixels is None:
+        pixels = numpy.asarray(Image.open(filepath).convert('RGBA'), numpy.float32) / 255
+        alpha = pixels[..., 3:] * opacity
+        if mask_filepath:
+            mask_pixels = numpy.asarray(Image.open(mask_filepath).convert('L'), numpy.float32)
+            if mask_pixels.shape == pixels.shape[:2]:
+                alpha *= mask_pixels[..., None] / 255
+        pixels[..., :3] *= alpha
+        pixels[..., 3:] = alpha
+        while len(_picture_cache) >= CACHE_SIZE:
+            _picture_cache.popitem(last=False)
+    _picture_cache[key] = pixels
+    return pixels
+
+
+def composite(canvas, pixels, x, y):
+    """ Composite premultiplied pixels over canvas at x, y, clipped to canvas
+    """
+    height, width = canvas.shape[:2]
+    left, top = max(x, 0), max(y, 0)
+    right, bottom = min(x + pixels.shape[1], width), min(y + pixels.shape[0], height)
+    if left >= right or top >= bottom:
+        return
+    source = pixels[top - y:bottom - y, left - x:right - x]
+    target = canvas[top:bottom, left:right]
+    target *= 1 - source[..., 3:]
+    target += source
+
+
+def visible_layers(group):
+    """ Yields visible layers of group from the bottom, layers of layout.json are
+    listed from the top
+    """
+    for layer in reversed(group.layers):
+        if not getattr(layer, 'visible', True):
+            continue
+        if getattr(layer, 'layers', None) is not None:
+            for sub_layer in visible_layers(layer):
+                yield sub_layer
+        else:
+            yield layer
+
+
+def render_orientation(skin_dir, index, orientation, short):
+    """ Returns the uint8 RGBA preview of an orientation group of a skin
+    """
+    group = index.find_layer(orientation)
+    background = group and index.find_layer('background_%s.png' % short, group)
+    if background is None:
+        raise ValueError('no %s background layer' % orientation)
+    screen = index.find_layer('screen_%s.png' % short, group)
+    origin = background.offsets
+
+    canvas = numpy.zeros((background.height, background.width, 4), numpy.float32)
+    # Orientation groups are rendered whatever their visibility, landscape is hidden
+    for layer in visible_layers(group):
+        x, y = layer.offsets[0] - origin[0], layer.offsets[1] - origin[1]
+        if layer is screen:
+            pixels = numpy.broadcast_to(numpy.array(SCREEN_COLOR, numpy.float32) / 255,
+                                        (layer.height, layer.width, 4))
+        else:
+            pixels = layer_pixels(skin_dir, layer)
+        if pixels is not None:
+            composite(canvas, pixels, x, y)
+
+    alpha = canvas[..., 3:]
+    numpy.divide(canvas[..., :3], alpha, out=canvas[..., :3], where=alpha > 0)
+    canvas *= 255
+    return numpy.rint(canvas, out=canvas).astype(numpy.uint8)
+
+
+def diff_pixels(preview, reference):
+    """ Returns the number of changed pixels of two previews and the diff picture,
+    None when no pixel changed
+    """
+    if preview.shape != reference.shape:
+        reference = numpy.zeros_like(preview)
+    # Pixels are compared as 32 bits words
+    changed = preview.view(numpy.uint32)[..., 0] != reference.view(numpy.uint32)[..., 0]
+    count = int(numpy.count_nonzero(changed))
+    if not count:
+        return 0, None
+    diff = numpy.empty_like(preview)
+    diff[..., :3] = (reference[..., :3].sum(axis=2, dtype=numpy.uint16) // 12 + 0x80)[..., None]
+    diff[..., 3] = 0xff
+    diff[changed] = DIFF_COLOR
+    return count, diff
+
+
+def preview_name(skin_dir, orientation):
+    return '%s_%s.png' % (os.path.basename(os.path.normpath(skin_dir)), orientation)
+
+
+def render_skin(args):
+    """ Render previews of a skin, compared with previews of reference_dir when given.
+    Returns (skin_dir, [(filepath, changed pixels or None)], error), results are None
+    for skins with a layout.json of the older format, which are skipped
+    """
+    skin_dir, output_dir, reference_dir = args
+    if is_older_layout_json(skin_dir):
+        return skin_dir, None, None
+    results = []
+    try:
+        index = LayerIndex(skin_import_json(skin_dir))
+        for orientation, short in ORIENTATIONS:
+            preview = render_orientation(skin_dir, index, orientation, short)
+            name = preview_name(skin_dir, orientation)
+            filepath = os.path.join(output_dir, name)
+            save_image(Image.fromarray(preview, 'RGBA'), filepath)
+            changed = None
+            if reference_dir:
+                reference_filepath = os.path.join(reference_dir, name)
+                if os.path.isfile(reference_filepath):
+                    reference = numpy.asarray(Image.open(reference_filepath).convert('RGBA'))
+                else:
+                    reference = numpy.zeros((0, 0, 4), numpy.uint8)
+                changed, diff = diff_pixels(preview, reference)
+                diff_filepath = os.path.splitext(filepath)[0] + '_diff.png'
+                if changed:
+                    save_image(Image.fromarray(diff, 'RGBA'), diff_filepath)
+                elif os.path.isfile(diff_filepath):
+                    os.remove(diff_filepath)
+            results.append((filepath, changed))
+    except (IOError, OSError, ValueError, AttributeError) as e:
+        return skin_dir, results, str(e)
+    return skin_dir, results, None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render previews of skins')
+    parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(),
+                        help='number of worker processes, one per core by default')
+    parser.add_argument('-o', '--output', default='previews', metavar='output_dir',
+                        help='directory of previews, previews by default')
+    parser.add_argument('--diff', metavar='reference_dir',
+                        help='compare previews to the ones of reference_dir')
+    parser.add_argument('skin_dirs', nargs='*', metavar='skin_dir',
+                        help='skin directories, ESKIN_* by default')
+    args = parser.parse_args(argv)
+
+    if numpy is None:
+        print('ERROR    NumPy and Pillow are required: pip install numpy Pillow',
+              file=sys.stderr)
+        return 2
+
+    skin_dirs = args.skin_dirs or sorted(d for d in glob.glob('ESKIN_*') if os.path.isdir(d))
+    if not os.path.isdir(args.output):
+        os.makedirs(args.output)
+    os.environ.setdefault(PNG_PROFILE_ENV, PREVIEW_PNG_PROFILE)
+
+    status = 0
+    tasks = [(skin_dir, args.output, args.diff) for skin_dir in skin_dirs]
+    if not tasks:
+        return status
+    pool = multiprocessing.Pool(max(1, min(args.jobs, len(tasks))))
+    try:
+        for skin_dir, results, error in pool.imap(render_skin, tasks):
+            if results is None:
+                print('SKIP     %s: older %s format' % (skin_dir, JSON_LAYOUT_FILE))
+                continue
+            for filepath, changed in results:
+                print('PREVIEW  %s' % filepath)
+                if changed:
+                    print('DIFF     %s %d pixels' % (filepath, changed))
+                    status = max(status, 1)
+            if error:
+                print('ERROR    %s: %s' % (skin_dir, error), file=sys.stderr)
+                status = 2
+    finally:
+        pool.close()
+        pool.join()
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
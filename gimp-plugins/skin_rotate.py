@@ -0,0 +1,213 @@
+#! /usr/bin/env python
+""" Generate the landscape group of exported skins from the portrait one, without Gimp.
+
+Pictures of the portrait group are rotated in a pool of processes, their offsets are
+rotated about the image center as pdb.gimp_item_transform_rotate_simple does, and
+layout.json and layout are written again, layout files edited by hand are kept. Like
+the Gimp skin export, the group is only generated when it is missing or hidden, and
+the opposite rotation is done for skins drawn in landscape.
+
+USAGE : skin_rotate.py [-j workers] [--force] <skin_dir> [...]
+"""
+from __future__ import print_function
+
+import os
+import re
+import sys
+import argparse
+import multiprocessing
+from collections import OrderedDict
+
+from gimp_layout import JSON_LAYOUT_FILE, load_layout_dict, dump_layout_dict
+from skin_layout import SKIN_LAYOUT_FILE, LayerNameError, skin_layout, skin_import_json
+from skin_layout import is_png
+from png_encode import save_image
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+ORIENTATIONS = ('portrait', 'landscape')
+
+
+def rotated_name(name, direction):
+    """ Returns the name of a layer in the rotated group, as skin_rotate_group names it
+    """
+    return re.sub(r'(.*)(_%s)(\.\w*) ?#?.*' % direction[0][:4],
+                  '\\1_%s\\3' % direction[1][:4], name)
+
+
+def rotate_offsets(offsets, width, height, center, clockwise):
+    """ Returns offsets of a width x height rectangle rotated by 90 degrees about center
+    """
+    x, y = offsets
+    cx, cy = center
+    if clockwise:
+        return [cx - (y + height - cy), cy + x - cx]
+    return [cx + y - cy, cy - (x + width - cx)]
+
+
+def rotate_layer(layer, direction, center, clockwise, renamed):
+    """ Returns a rotated copy of a layout.json layer, None if it keeps its name.
+    (source, target) names of rotated pictures are collected into renamed
+    """
+    name = layer['name'] if 'layers' in layer else rotated_name(layer['name'], direction)
+    if name == layer['name'] and 'layers' not in layer:
+        print('SKIP     %s: not named like <name>_%s.png' % (name, direction[0][:4]))
+        return None
+    rotated = OrderedDict(layer)
+    rotated['name'] = name
+    rotated['width'], rotated['height'] = layer['height'], layer['width']
+    if 'offsets' in layer:
+        rotated['offsets'] = rotate_offsets(layer['offsets'], layer['width'], layer['height'],
+                                            center, clockwise)
+    if layer.get('mask'):
+        rotated['mask'] = rotate_layer(layer['mask'], direction, center, clockwise, renamed)
+    if 'layers' in layer:
+        rotated['layers'] = [l for l in (rotate_layer(l, direction, center, clockwise, renamed)
+                                         for l in layer['layers']) if l]
+    else:
+        renamed.append((layer['name'], name))
+    return rotated
+
+
+def layer_names(layer):
+    names = [layer['name']]
+    if layer.get('mask'):
+        names.append(layer['mask']['name'])
+    for sub_layer in layer.get('layers', ()):
+        names.extend(layer_names(sub_layer))
+    return names
+
+
+def rotate_png(args):
+    """ Write the rotated picture of source to target, returns the target file path
+    """
+    source, target, clockwise = args
+    image = Image.open(source)
+    image.load()
+    save_image(image.transpose(clockwise and Image.ROTATE_270 or Image.ROTATE_90), target)
+    return target
+
+
+def is_generated_layout(skin_dir):
+    """ Tells layout files generated from layout.json, not edited by hand
+    """
+    try:
+        with open(os.path.join(skin_dir, SKIN_LAYOUT_FILE), 'r') as f:
+            return skin_layout(skin_import_json(skin_dir)) == f.read()
+    except Exception:
+        return False
+
+
+def skin_rotate_tasks(skin_dir, force=False):
+    """ Write layout.json of skin_dir with the rotated group, remove pictures of the group
+    it replaces. Returns the list of (source, target, clockwise) rotation tasks,
+    None when the rotated group is visible and force is not set
+    """
+    with open(os.path.join(skin_dir, JSON_LAYOUT_FILE), 'r') as f:
+        image = load_layout_dict(f)
+    if not isinstance(image.get('layers'), list):
+        raise ValueError('unsupported %s format' % JSON_LAYOUT_FILE)
+
+    groups = [l for l in image['layers'] if l['name'] in ORIENTATIONS]
+    if not groups:
+        raise ValueError('no portrait or landscape group')
+    direction = list(ORIENTATIONS)
+    if groups[0]['name'] == direction[1]:
+        direction.reverse()
+    source_group = groups[0]
+    target_group = [l for l in groups if l['name'] == direction[1]]
+    if target_group and target_group[0].get('visible') and not force:
+        return None
+
+    # Portrait to landscape is rotated counterclockwise, as ROTATE_270 in Gimp
+    clockwise = direction[0] == ORIENTATIONS[1]
+    center = image['width'] // 2, image['height'] // 2
+    renamed = []
+    rotated_group = rotate_layer(source_group, direction, center, clockwise, renamed)
+    rotated_group['name'] = source_group['name'].replace(*direction)
+    rotated_group['visible'] = False
+
+    old_names = set()
+    if target_group:
+        old_names = set(layer_names(target_group[0]))
+        image['layers'].remove(target_group[0])
+    image['layers'].insert(image['layers'].index(source_group) + 1, rotated_group)
+    with open(os.path.join(skin_dir, JSON_LAYOUT_FILE), 'w') as f:
+        dump_layout_dict(image, f)
+
+    tasks = []
+    for source, target in renamed:
+        source = os.path.join(skin_dir, source)
+        if os.path.isfile(source) and is_png(source):
+            tasks.append((source, os.path.join(skin_dir, target), clockwise))
+        else:
+            print('SKIP     %s: not a png file' % source)
+    for name in old_names - set(layer_names(image)):
+        filepath = os.path.join(skin_dir, name)
+        if os.path.isfile(filepath):
+            print('REMOVE   %s' % filepath)
+            os.remove(filepath)
+    return tasks
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate the landscape group of skins')
+    parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(),
+                        help='number of worker processes, one per core by default')
+    parser.add_argument('--force', action='store_true',
+                        help='replace the rotated group even when it is visible')
+    parser.add_argument('skin_dirs', nargs='+', metavar='skin_dir')
+    args = parser.parse_args(argv)
+
+    if Image is None:
+        print('ERROR    Pillow is required: pip install Pillow', file=sys.stderr)
+        return 2
+
+    tasks, skin_dirs = [], []
+    for skin_dir in args.skin_dirs:
+        # A layout generated from layout.json is generated again, edited ones are kept
+        generated = is_generated_layout(skin_dir)
+        try:
+            skin_tasks = skin_rotate_tasks(skin_dir, args.force)
+        except (IOError, OSError, ValueError) as e:
+            print('ERROR    %s: %s' % (skin_dir, e), file=sys.stderr)
+            return 2
+        if skin_tasks is None:
+            print('VISIBLE  %s: rotated group kept, use --force to replace it' % skin_dir)
+            continue
+        tasks.extend(skin_tasks)
+        if generated:
+            skin_dirs.append(skin_dir)
+        else:
+            print('WARNING  %s: edited %s kept, update its rotated part by hand' %
+                  (skin_dir, SKIN_LAYOUT_FILE))
+
+    # Biggest pictures first, to balance workers
+    tasks.sort(key=lambda t: -os.path.getsize(t[0]))
+    if tasks:
+        pool = multiprocessing.Pool(max(1, min(args.jobs, len(tasks))))
+        try:
+            for target in pool.imap_unordered(rotate_png, tasks):
+                print('PNG      %s' % target)
+        finally:
+            pool.close()
+            pool.join()
+
+    for skin_dir in skin_dirs:
+        layout_filepath = os.path.join(skin_dir, SKIN_LAYOUT_FILE)
+        try:
+            layout = skin_layout(skin_import_json(skin_dir))
+        except (ValueError, AttributeError, LayerNameError) as e:
+            print('ERROR    %s: %s' % (skin_dir, e), file=sys.stderr)
+            return 2
+        with open(layout_filepath, 'w') as f:
+            f.write(layout)
+        print('LAYOUT   %s' % layout_filepath)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,287 @@
+#! /usr/bin/env python
+""" Check that exported skins are consistent, without Gimp and without decoding pictures.
+
+The `layout` file of each skin is parsed and checked against its pictures and
+layout.json, sizes of pictures are read from their png IHDR chunk:
+  name      button layers are named <key>_port.png or <key>_land.png, in their group
+  picture   pictures of `layout` and layers of layout.json exist and are png files
+  size      sizes of layout.json layers are the ones of their pictures
+  bounds    buttons fit inside the background of their part
+  layout    sizes and positions of `layout` are the ones layout.json generates
+
+Skins with a layout.json of an older format are only checked against their pictures.
+Skins are checked in a pool of threads, all ESKIN_* directories by default. Problems
+are printed, or written as json with --json, the exit status is 1 if a skin is broken.
+
+USAGE : skin_validate.py [-j workers] [--json] [skin_dir ...]
+        skin_validate.py --self-test
+"""
+from __future__ import print_function
+
+import os
+import sys
+import json
+import glob
+import argparse
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from collections import OrderedDict
+
+from gimp_layout import LayerIndex, JSON_LAYOUT_FILE, getlayers
+from skin_layout import SKIN_LAYOUT_FILE, BUTTON_NAME, LayerNameError
+from skin_layout import parse_layout, png_size, layer_size, skin_layout, skin_import_json
+from skin_layout import is_older_layout_json
+
+ORIENTATIONS = (('portrait', 'port'), ('landscape', 'land'))
+
+# Layers of orientation groups which are no buttons
+NOT_BUTTONS = '(?!(background|screen))'
+
+
+class SkinProblems(object):
+    """ Problems found in a skin, with the sizes of its pictures read once
+    """
+
+    def __init__(self, skin_dir):
+        self.skin_dir = skin_dir
+        self.problems = []
+        self._sizes = {}
+
+    def add(self, check, name, message):
+        self.problems.append(OrderedDict([('check', check), ('file', name),
+                                          ('message', message)]))
+
+    def picture_size(self, name):
+        """ Returns (width, height) of a picture of the skin, None if it is no png file
+        """
+        if name not in self._sizes:
+            filepath = os.path.join(self.skin_dir, name)
+            try:
+                self._sizes[name] = os.path.isfile(filepath) and png_size(filepath) or None
+            except (IOError, OSError):
+                self._sizes[name] = None
+        return self._sizes[name]
+
+
+def layout_int(block, key):
+    try:
+        return int(block[key])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def check_names(skin, index):
+    """ Check button layers of orientation groups, as skin_layout names their pictures
+    """
+    valid = True
+    for orientation, short in ORIENTATIONS:
+        group = index.find_layer(orientation)
+        if group is None:
+            skin.add('name', JSON_LAYOUT_FILE, 'no %s group' % orientation)
+            valid = False
+            continue
+        for layer in index.find_layers(NOT_BUTTONS, group):
+            if getattr(layer, 'layers', None) is not None:
+                continue
+            match = BUTTON_NAME.match(layer.name)
+            if not match or layer.name != '%s_%s.png' % (match.group(1), short):
+                skin.add('name', layer.name, 'button layer of %s group must be named '
+                                             '<key>_%s.png' % (orientation, short))
+                valid = False
+    return valid
+
+
+def check_layers(skin, image):
+    """ Check pictures and sizes of layers of orientation groups
+    """
+    for orientation, _ in ORIENTATIONS:
+        group = next((l for l in image.layers if l.name == orientation), None)
+        for parent, layer in group and getlayers(group) or ():
+            if getattr(layer, 'layers', None) is not None or \
+                    getattr(parent, 'mask', None) is layer:
+                continue
+            size = skin.picture_size(layer.name)
+            if size is None:
+                skin.add('picture', layer.name, 'missing png picture of layout.json layer')
+            elif size != layer_size(layer):
+                skin.add('size', layer.name, 'layout.json size %dx%d, picture size %dx%d' %
+                         (layer_size(layer) + size))
+
+
+def check_pictures(skin, layout):
+    """ Check pictures of layout and that buttons fit inside their background
+    """
+    parts = layout.get('parts', {})
+    for part_name, part in parts.items():
+        if not isinstance(part, dict):
+            continue
+        background = part.get('background', {}).get('image')
+        background_size = background and skin.picture_size(background)
+        if background and background_size is None:
+            skin.add('picture', background, 'missing png picture of %s part' % part_name)
+        for button_name, button in part.get('buttons', {}).items():
+            image = isinstance(button, dict) and button.get('image')
+            size = image and skin.picture_size(image)
+            if not size:
+                skin.add('picture', image or button_name,
+                         'missing png picture of %s button' % button_name)
+                continue
+            x, y = layout_int(button, 'x'), layout_int(button, 'y')
+            if x is None or y is None:
+                skin.add('layout', SKIN_LAYOUT_FILE, 'no position of %s button of %s part' %
+                         (button_name, part_name))
+            elif background_size and (x < 0 or y < 0 or x + size[0] > background_size[0] or
+                                      y + size[1] > background_size[1]):
+                skin.add('bounds', image, '%dx%d+%d+%d outside of %dx%d %s' %
+                         (size + (x, y) + tuple(background_size) + (background,)))
+    for layout_name, block in layout.get('layouts', {}).items():
+        onion = isinstance(block, dict) and block.get('onion', {}).get('image')
+        if onion and skin.picture_size(onion) is None:
+            skin.add('picture', onion, 'missing png picture of %s onion' % layout_name)
+
+
+def compare_layout(skin, expected, layout, path=()):
+    """ Check that values of expected, the layout generated from layout.json, are the
+    ones of layout. Blocks and values of layout only, like onion skins, are ignored
+    """
+    for key, value in expected.items():
+        key_path = path + (key,)
+        actual = layout.get(key) if isinstance(layout, dict) else None
+        if isinstance(value, dict):
+            if actual is None:
+                skin.add('layout', SKIN_LAYOUT_FILE, 'no %s block' % '/'.join(key_path))
+            else:
+                compare_layout(skin, value, actual, key_path)
+        elif actual != value:
+            skin.add('layout', SKIN_LAYOUT_FILE, '%s is %s, layout.json gives %s' %
+                     ('/'.join(key_path), actual, value))
+
+
+def validate_skin(skin_dir):
+    """ Returns the list of problems of a skin directory
+    """
+    skin = SkinProblems(skin_dir)
+    try:
+        with open(os.path.join(skin_dir, SKIN_LAYOUT_FILE), 'r') as f:
+            layout = parse_layout(f.read())
+    except (IOError, OSError, ValueError) as e:
+        skin.add('layout', SKIN_LAYOUT_FILE, str(e))
+        return skin.problems
+    check_pictures(skin, layout)
+
+    try:
+        image = skin_import_json(skin_dir)
+    except (IOError, OSError, ValueError) as e:
+        # Older layout.json formats can not generate layout
+        if not is_older_layout_json(skin_dir):
+            skin.add('layout', JSON_LAYOUT_FILE, str(e))
+        return skin.problems
+
+    index = LayerIndex(image)
+    if not check_names(skin, index):
+        return skin.problems
+    check_layers(skin, image)
+
+    def size(layer):
+        return skin.picture_size(layer.name) or layer_size(layer)
+
+    try:
+        expected = parse_layout(skin_layout(image, size, index))
+    except (AttributeError, LayerNameError) as e:
+        skin.add('layout', JSON_LAYOUT_FILE, 'cannot generate layout: %s' % (e,))
+        return skin.problems
+    compare_layout(skin, expected, layout)
+    return skin.problems
+
+
+def self_test():
+    """ Check the layout parser and comparison on small samples, returns the exit status
+    """
+    if not __debug__:
+        print('ERROR    self-test needs asserts, run it without -O', file=sys.stderr)
+        return 2
+    layout = parse_layout("""
+parts {
+    portrait {
+        background {
+            image   background_port.png
+        }
+        buttons {
+        }
+    }
+}
+layouts {
+    portrait {
+        width     480
+        onion {
+            image   overlay.png
+        }
+        part2 { name device
+            x 12 }
+    }
+}
+""")
+    assert layout == {
+        'parts': {'portrait': {'background': {'image': 'background_port.png'}, 'buttons': {}}},
+        'layouts': {'portrait': {'width': '480', 'onion': {'image': 'overlay.png'},
+                                 'part2': {'name': 'device', 'x': '12'}}}}
+    assert list(layout['layouts']['portrait']) == ['width', 'onion', 'part2']
+    for content in ('parts {', 'parts { } }', 'parts { width }', '{ }'):
+        try:
+            parse_layout(content)
+            assert False, 'invalid layout parsed: %s' % content
+        except ValueError:
+            pass
+
+    # Empty blocks match, blocks of layout only are ignored
+    skin = SkinProblems('.')
+    compare_layout(skin, parse_layout('parts { portrait { buttons { } } }'),
+                   parse_layout('parts { portrait { buttons { } } } layouts { x 1 }'))
+    assert skin.problems == []
+    compare_layout(skin, parse_layout('parts { portrait { buttons { } x 1 } } layouts { y 2 }'),
+                   parse_layout('parts { portrait { buttons { } x 2 } }'))
+    assert [p['message'] for p in skin.problems] == [
+        'parts/portrait/x is 2, layout.json gives 1', 'no layouts block']
+    print('OK       self-test')
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check that exported skins are consistent')
+    parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(),
+                        help='number of worker threads, one per core by default')
+    parser.add_argument('--json', action='store_true', help='write results as json')
+    parser.add_argument('--self-test', action='store_true',
+                        help='check the layout parser and exit')
+    parser.add_argument('skin_dirs', nargs='*', metavar='skin_dir',
+                        help='skin directories, ESKIN_* by default')
+    args = parser.parse_args(argv)
+
+    if args.self_test:
+        return self_test()
+
+    skin_dirs = args.skin_dirs or sorted(d for d in glob.glob('ESKIN_*') if os.path.isdir(d))
+    pool = ThreadPool(max(1, min(args.jobs, len(skin_dirs) or 1)))
+    try:
+        results = pool.map(validate_skin, skin_dirs)
+    finally:
+        pool.close()
+        pool.join()
+
+    if args.json:
+        print(json.dumps([OrderedDict([('skin', skin_dir), ('ok', not problems),
+                                       ('problems', problems)])
+                          for skin_dir, problems in zip(skin_dirs, results)],
+                         indent=2, separators=(',', ': ')))
+    else:
+        for skin_dir, problems in zip(skin_dirs, results):
+            if not problems:
+                print('OK       %s' % skin_dir)
+            for problem in problems:
+                print('BROKEN   %s: %s %s: %s' % (skin_dir, problem['check'],
+                                                  problem['file'], problem['message']))
+    return any(results) and 1 or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
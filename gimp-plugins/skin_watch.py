@@ -0,0 +1,164 @@
+#! /usr/bin/env python
+""" Export skins again each time their xcf file is saved, with one Gimp kept running.
+
+A Gimp batch interpreter loads gimp_export_skin.py once, and exports the xcf files
+queued by this script. A file is queued when its modification time has not changed
+for the debounce delay, so that files are not exported while Gimp writes them.
+
+USAGE : skin_watch.py [-d densities] [-r ratios] [--debounce seconds] <image.xcf|'glob'> [...]
+"""
+from __future__ import print_function
+
+import os
+import sys
+import glob
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+PLUGINS_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_FILE = os.path.join(PLUGINS_DIR, 'gimp_export_skin.py')
+
+POLL_INTERVAL = 0.5
+
+
+def watched_files(patterns):
+    """ Returns xcf files matching patterns, quoted globs included
+    """
+    filepaths = set()
+    for pattern in patterns:
+        filepaths.update(f for f in glob.glob(pattern) if os.path.isfile(f))
+    return sorted(os.path.abspath(f) for f in filepaths)
+
+
+def mtime(filepath):
+    try:
+        return os.path.getmtime(filepath)
+    except OSError:
+        return None
+
+
+class SkinWatch(object):
+    """ Queue xcf files changed since last poll, report results of the Gimp worker
+    """
+
+    def __init__(self, patterns, queue_dir, densities=None, ratios=None, debounce=1.0,
+                 gimp='gimp'):
+        self.patterns = patterns
+        self.queue_dir = queue_dir
+        self.densities = densities
+        self.ratios = ratios
+        self.debounce = debounce
+        self.gimp = gimp
+        self.worker = None
+        self.next_job = 0
+        # xcf path: mtime when last exported, or queued
+        self.exported = {}
+        # xcf path: (mtime, time it was seen) of changes waiting for the debounce delay
+        self.changed = {}
+        # job: xcf path, until its result is read
+        self.jobs = {}
+
+    def start_worker(self):
+        env = dict(os.environ, XCF_WATCH=self.queue_dir)
+        env['PYTHONPATH'] = os.pathsep.join(p for p in (PLUGINS_DIR, env.get('PYTHONPATH')) if p)
+        if self.densities:
+            env['XCF_DENSITIES'] = self.densities
+        if self.ratios:
+            env['XCF_RATIOS'] = self.ratios
+        with open(PLUGIN_FILE, 'r') as plugin:
+            self.worker = subprocess.Popen(
+                [self.gimp, '-idf', '--batch-interpreter=python-fu-eval',
+                 '-b', '-', '-b', 'pdb.gimp_quit(0)'], stdin=plugin, env=env)
+        print('WORKER   Gimp started (pid %d)' % self.worker.pid)
+
+    def stop_worker(self):
+        open(os.path.join(self.queue_dir, 'stop'), 'w').close()
+        if self.worker and self.worker.poll() is None:
+            self.worker.wait()
+
+    def queue(self, xcf_path):
+        job = os.path.join(self.queue_dir, str(self.next_job))
+        with open(job + '.tmp', 'w') as f:
+            f.write(xcf_path + '\n')
+        os.rename(job + '.tmp', job + '.job')
+        self.jobs[job] = xcf_path
+        self.next_job += 1
+        print('QUEUED   %s' % xcf_path)
+
+    def poll_files(self, now):
+        for xcf_path in watched_files(self.patterns):
+            modified = mtime(xcf_path)
+            if modified is None or modified == self.exported.get(xcf_path):
+                continue
+            if xcf_path not in self.exported:
+                # Files are exported when they change, not when the watch starts
+                self.exported[xcf_path] = modified
+                print('WATCH    %s' % xcf_path)
+                continue
+            if self.changed.get(xcf_path, (None,))[0] != modified:
+                self.changed[xcf_path] = (modified, now)
+            elif now - self.changed[xcf_path][1] >= self.debounce:
+                del self.changed[xcf_path]
+                self.exported[xcf_path] = modified
+                if not any(p == xcf_path and not os.path.exists(j + '.run')
+                           for j, p in self.jobs.items()):
+                    self.queue(xcf_path)
+
+    def poll_results(self):
+        for job, xcf_path in sorted(self.jobs.items()):
+            if os.path.exists(job + '.ok'):
+                with open(job + '.ok', 'r') as f:
+                    print('OK       %s (%s)' % (xcf_path, f.read().strip()))
+            elif os.path.exists(job + '.err'):
+                print('FAILED   %s' % xcf_path)
+                with open(job + '.err', 'r') as f:
+                    for line in f:
+                        print('         %s' % line.rstrip('\n'))
+            elif self.worker.poll() is not None and os.path.exists(job + '.run'):
+                print('FAILED   %s (Gimp worker exited)' % xcf_path)
+                os.remove(job + '.run')
+            else:
+                continue
+            del self.jobs[job]
+
+    def run(self):
+        self.start_worker()
+        while True:
+            self.poll_files(time.time())
+            self.poll_results()
+            if self.worker.poll() is not None:
+                print('WORKER   Gimp exited (status %d), starting again' % self.worker.returncode)
+                self.start_worker()
+            time.sleep(POLL_INTERVAL)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export skins each time xcf files are saved')
+    parser.add_argument('-d', '--densities',
+                        help='export each density to <image>_<density>/, like "mdpi xhdpi"')
+    parser.add_argument('-r', '--ratios',
+                        help='export each aspect ratio to <image>_<density>_4x3/, like "DEFAULT 4/3"')
+    parser.add_argument('--debounce', type=float, default=1.0,
+                        help='seconds a file must be left unchanged before it is exported')
+    parser.add_argument('--gimp', default='gimp', help='Gimp executable')
+    parser.add_argument('patterns', nargs='+', metavar='image.xcf')
+    args = parser.parse_args(argv)
+
+    queue_dir = tempfile.mkdtemp(prefix='skin_watch.')
+    watch = SkinWatch(args.patterns, queue_dir, args.densities, args.ratios, args.debounce,
+                      args.gimp)
+    try:
+        watch.run()
+    except KeyboardInterrupt:
+        print()
+    finally:
+        watch.stop_worker()
+        shutil.rmtree(queue_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
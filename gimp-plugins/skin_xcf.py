@@ -0,0 +1,669 @@
+#! /usr/bin/env python
+""" Read xcf files and export their layers and layout.json without Gimp.
+
+The reader covers what skins use: layer groups, offsets, visibility, linked flags,
+opacity, modes, masks and text layers, with uncompressed, RLE or zlib tiles. Pixels
+are streamed one strip of tiles at a time, memory stays bounded by the image width.
+Layers are exported to the same files gimp_export_pngs writes, in a pool of processes,
+and layers unchanged since the last export, by a digest of their compressed tiles,
+are not decoded again.
+
+With --skin, a skin is exported as the Gimp skin export does at the DEFAULT density
+and ratio: linked layers are cropped to their alpha bounds, the landscape group is
+rotated from the portrait one when it is missing or hidden, and layout is generated.
+Rotation requires Pillow, the rest only the standard library.
+
+USAGE : skin_xcf.py [-j workers] [--visible] [-o save_path] <image.xcf> [...]
+        skin_xcf.py --skin [-j workers] <image.xcf> [...]
+        skin_xcf.py --self-test
+"""
+from __future__ import print_function
+
+import os
+import re
+import sys
+import zlib
+import struct
+import hashlib
+import argparse
+import multiprocessing
+from collections import OrderedDict
+
+from gimp_layout import JSON_LAYOUT_FILE, gimp_import_manifest, gimp_export_manifest
+from gimp_layout import getlayers, dump_layout, unlink_shared
+from skin_layout import SKIN_LAYOUT_FILE, LayerNameError, skin_layout, skin_import_json
+from skin_rotate import main as skin_rotate
+from png_encode import PNG_COLOR_TYPES, PNG_COLOR_GRAY, png_profile, indexed_to_rgba, write_png
+
+XCF_SIGNATURE = b'gimp xcf '
+TILE_SIZE = 64
+
+PROP_END = 0
+PROP_COLORMAP = 1
+PROP_OPACITY = 6
+PROP_MODE = 7
+PROP_VISIBLE = 8
+PROP_LINKED = 9
+PROP_OFFSETS = 15
+PROP_COMPRESSION = 17
+PROP_RESOLUTION = 19
+PROP_PARASITES = 21
+PROP_GROUP_ITEM = 29
+PROP_ITEM_PATH = 30
+
+COMPRESS_NONE = 0
+COMPRESS_RLE = 1
+COMPRESS_ZLIB = 2
+
+# Layer types: RGB, RGBA, GRAY, GRAYA, INDEXED, INDEXEDA
+BYTES_PER_PIXEL = (3, 4, 1, 2, 1, 2)
+
+TEXT_PARASITE = 'gimp-text-layer'
+COMMENT_PARASITE = 'gimp-comment'
+TEXT_ESCAPES = {'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+# Name of the working copy exported by the Gimp skin export
+SKIN_IMAGE_NAME = 'Untitled'
+ORIENTATIONS = ('portrait', 'landscape')
+
+
+class XcfImage(object):
+    """ Image of an xcf file, with the attributes of a Gimp image written to layout.json
+    """
+
+    def __init__(self, name, width, height):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.layers = []
+        self.base_type = 0
+        self.compression = COMPRESS_RLE
+        self.resolution = (72.0, 72.0)
+        self.colormap = None
+        self.parasites = {}
+
+
+class XcfChannel(object):
+    """ Layer mask, with the attributes of a Gimp channel written to layout.json
+    """
+
+    def __init__(self, name, width, height):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.visible = True
+        self.linked = False
+        self.opacity = 100.0
+        self.offsets = (0, 0)
+        self.type = 2
+        self.hierarchy = 0
+
+
+class XcfLayer(object):
+    """ Layer of an xcf file, group layers have layers, text layers have text
+    """
+
+    def __init__(self, name, width, height, type):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.visible = True
+        self.linked = False
+        self.opacity = 100.0
+        self.mode = 0
+        self.offsets = (0, 0)
+        self.mask = None
+        self.type = type
+        self.text = None
+        self.hierarchy = 0
+
+
+class XcfReader(object):
+    """ Reads the structure of an xcf file, pixels are read on demand by drawable_strips
+    """
+
+    def __init__(self, f):
+        self.f = f
+
+    def u32(self):
+        return struct.unpack('>I', self.f.read(4))[0]
+
+    def string(self):
+        size = self.u32()
+        return size and self.f.read(size)[:-1].decode('utf-8') or ''
+
+    def pointers(self):
+        pointers = []
+        pointer = self.u32()
+        while pointer:
+            pointers.append(pointer)
+            pointer = self.u32()
+        return pointers
+
+    def properties(self):
+        props = []
+        while True:
+            prop_type, size = self.u32(), self.u32()
+            if prop_type == PROP_END:
+                return props
+            props.append((prop_type, self.f.read(size)))
+
+    def read_image(self, name):
+        signature = self.f.read(14)
+        if not signature.startswith(XCF_SIGNATURE):
+            raise ValueError('not an xcf file')
+        if signature[9:13] not in (b'file', b'v001', b'v002', b'v003'):
+            # Later versions have 64 bits pointers and high bit depths
+            raise ValueError('unsupported xcf version: %s' % signature[9:13].decode('ascii'))
+        image = XcfImage(name, self.u32(), self.u32())
+        image.base_type = self.u32()
+        for prop_type, data in self.properties():
+            if prop_type == PROP_COMPRESSION:
+                image.compression = ord(data[:1])
+            elif prop_type == PROP_RESOLUTION:
+                image.resolution = struct.unpack('>2f', data)
+            elif prop_type == PROP_COLORMAP:
+                count = struct.unpack('>I', data[:4])[0]
+                image.colormap = data[4:4 + 3 * count]
+            elif prop_type == PROP_PARASITES:
+                image.parasites = parse_parasites(data)
+        if image.compression not in (COMPRESS_NONE, COMPRESS_RLE, COMPRESS_ZLIB):
+            raise ValueError('unsupported tile compression: %d' % image.compression)
+
+        # Layers are listed top to bottom, layers of groups after their group
+        items = {}
+        for pointer in self.pointers():
+            self.f.seek(pointer)
+            layer, path = self.read_layer()
+            parent = path and items.get(tuple(path[:-1])) or image
+            parent.layers.append(layer)
+            items[tuple(path or (len(image.layers) - 1,))] = layer
+        return image
+
+    def read_layer(self):
+        width, height, layer_type = self.u32(), self.u32(), self.u32()
+        if layer_type >= len(BYTES_PER_PIXEL):
+            raise ValueError('unsupported layer type: %d' % layer_type)
+        layer = XcfLayer(self.string(), width, height, layer_type)
+        path = None
+        for prop_type, data in self.properties():
+            if prop_type == PROP_OPACITY:
+                # Same conversion as gimp_layer_get_opacity
+                layer.opacity = struct.unpack('>I', data)[0] / 255.0 * 100
+            elif prop_type == PROP_MODE:
+                layer.mode = struct.unpack('>I', data)[0]
+            elif prop_type == PROP_VISIBLE:
+                layer.visible = struct.unpack('>I', data)[0] != 0
+            elif prop_type == PROP_LINKED:
+                layer.linked = struct.unpack('>I', data)[0] != 0
+            elif prop_type == PROP_OFFSETS:
+                layer.offsets = struct.unpack('>2i', data)
+            elif prop_type == PROP_GROUP_ITEM:
+                layer.layers = []
+            elif prop_type == PROP_ITEM_PATH:
+                path = struct.unpack('>%dI' % (len(data) // 4), data)
+            elif prop_type == PROP_PARASITES:
+                text = parse_parasites(data).get(TEXT_PARASITE)
+                if text is not None:
+                    layer.text = parse_text(text)
+        layer.hierarchy = self.u32()
+        mask_pointer = self.u32()
+        if mask_pointer:
+            self.f.seek(mask_pointer)
+            layer.mask = self.read_channel()
+            layer.mask.offsets = layer.offsets
+        return layer, path
+
+    def read_channel(self):
+        width, height = self.u32(), self.u32()
+        channel = XcfChannel(self.string(), width, height)
+        for prop_type, data in self.properties():
+            if prop_type == PROP_OPACITY:
+                channel.opacity = struct.unpack('>I', data)[0] / 255.0 * 100
+            elif prop_type == PROP_VISIBLE:
+                channel.visible = struct.unpack('>I', data)[0] != 0
+            elif prop_type == PROP_LINKED:
+                channel.linked = struct.unpack('>I', data)[0] != 0
+        channel.hierarchy = self.u32()
+        return channel
+
+
+def parse_parasites(data):
+    """ Returns {name: data} of a PROP_PARASITES property
+    """
+    parasites = {}
+    offset = 0
+    while offset < len(data):
+        size = struct.unpack_from('>I', data, offset)[0]
+        name = data[offset + 4:offset + 3 + size].decode('utf-8')
+        offset += 4 + size + 4
+        size = struct.unpack_from('>I', data, offset)[0]
+        parasites[name] = data[offset + 4:offset + 4 + size]
+        offset += 4 + size
+    return parasites
+
+
+def _unescape(match):
+    escape = match.group(1)
+    if escape[0] in '01234567':
+        return chr(int(escape, 8))
+    return TEXT_ESCAPES.get(escape, escape)
+
+
+def parse_text(data):
+    """ Returns the text of a gimp-text-layer parasite, tags of markup text removed
+    """
+    data = data.rstrip(b'\0').decode('utf-8')
+    match = re.search(r'^\((text|markup) "((?:[^"\\]|\\.)*)"\)', data, re.M | re.S)
+    if not match:
+        return ''
+    text = re.sub(r'\\([0-7]{1,3}|.)', _unescape, match.group(2), flags=re.S)
+    if match.group(1) == 'markup':
+        text = re.sub(r'<[^>]*>', '', text)
+    return text
+
+
+def drawable_info(image, drawable):
+    """ Returns what is needed to read drawable pixels from another process
+    """
+    return (drawable.hierarchy, drawable.width, drawable.height,
+            image.compression, drawable.type, image.colormap)
+
+
+def _read_level(f, hierarchy):
+    f.seek(hierarchy)
+    bpp = struct.unpack('>3I', f.read(12))[2]
+    # Only the first level is used, others are not even written by Gimp 2.8
+    f.seek(struct.unpack('>I', f.read(4))[0] + 8)
+    tiles = []
+    pointer = struct.unpack('>I', f.read(4))[0]
+    while pointer:
+        tiles.append(pointer)
+        pointer = struct.unpack('>I', f.read(4))[0]
+    return bpp, tiles
+
+
+def _decode_rle(data, size, bpp):
+    """ Returns (pixels, bytes used) of a RLE tile, channels are encoded one after
+    the other and interleaved into pixels
+    """
+    pixels = bytearray(size * bpp)
+    offset = 0
+    for channel in range(bpp):
+        plane = bytearray(size)
+        i = 0
+        while i < size:
+            op = data[offset]
+            offset += 1
+            if op < 127:
+                plane[i:i + op + 1] = data[offset:offset + 1] * (op + 1)
+                i += op + 1
+                offset += 1
+            elif op == 127:
+                count = data[offset] << 8 | data[offset + 1]
+                plane[i:i + count] = data[offset + 2:offset + 3] * count
+                i += count
+                offset += 3
+            elif op == 128:
+                count = data[offset] << 8 | data[offset + 1]
+                plane[i:i + count] = data[offset + 2:offset + 2 + count]
+                i += count
+                offset += 2 + count
+            else:
+                count = 256 - op
+                plane[i:i + count] = data[offset:offset + count]
+                i += count
+                offset += count
+        if i != size:
+            raise ValueError('corrupt RLE tile')
+        pixels[channel::bpp] = plane
+    return pixels, offset
+
+
+def _decode_tile(data, compression, size, bpp):
+    """ Returns (pixels, bytes used) of a tile of size pixels
+    """
+    if compression == COMPRESS_RLE:
+        return _decode_rle(data, size, bpp)
+    if compression == COMPRESS_ZLIB:
+        decompressor = zlib.decompressobj()
+        pixels = bytearray(decompressor.decompress(bytes(data)))
+        return pixels, len(data) - len(decompressor.unused_data)
+    return data[:size * bpp], size * bpp
+
+
+def _tile_data(f, tiles, index, compression, tile_pixels, bpp):
+    """ Returns compressed data of tiles[index], the last tile is measured by decoding it
+    """
+    f.seek(tiles[index])
+    if index + 1 < len(tiles):
+        return bytearray(f.read(tiles[index + 1] - tiles[index]))
+    # Worst RLE case: a 2 bytes literal header per 128 bytes
+    data = bytearray(f.read(tile_pixels * bpp * 2 + 64))
+    return data[:_decode_tile(data, compression, tile_pixels, bpp)[1]]
+
+
+def drawable_hash(f, info):
+    """ Returns a digest of drawable compressed tiles, pixels are not decoded
+    """
+    hierarchy, width, height, compression, layer_type, colormap = info
+    bpp, tiles = _read_level(f, hierarchy)
+    h = hashlib.sha1(repr((width, height, bpp, layer_type, compression)).encode('ascii'))
+    if colormap:
+        h.update(colormap)
+    for index in range(len(tiles)):
+        tile_pixels = TILE_SIZE * TILE_SIZE
+        if index + 1 == len(tiles):
+            columns = (width + TILE_SIZE - 1) // TILE_SIZE
+            tile_pixels = (width - (index % columns) * TILE_SIZE) * \
+                (height - (index // columns) * TILE_SIZE)
+        h.update(_tile_data(f, tiles, index, compression, tile_pixels, bpp))
+    return h.hexdigest()
+
+
+def drawable_strips(f, info):
+    """ Yields rows of drawable pixels, one strip of tiles at a time
+    """
+    hierarchy, width, height, compression, layer_type, colormap = info
+    bpp, tiles = _read_level(f, hierarchy)
+    columns = (width + TILE_SIZE - 1) // TILE_SIZE
+    if len(tiles) != columns * ((height + TILE_SIZE - 1) // TILE_SIZE):
+        raise ValueError('unexpected tile count')
+    row_size = width * bpp
+    for y in range(0, height, TILE_SIZE):
+        strip_height = min(TILE_SIZE, height - y)
+        strip = bytearray(row_size * strip_height)
+        for column in range(columns):
+            x = column * TILE_SIZE
+            tile_width = min(TILE_SIZE, width - x)
+            index = y // TILE_SIZE * columns + column
+            data = _tile_data(f, tiles, index, compression, tile_width * strip_height, bpp)
+            pixels = _decode_tile(data, compression, tile_width * strip_height, bpp)[0]
+            tile_row = tile_width * bpp
+            for row in range(strip_height):
+                start = row * row_size + x * bpp
+                strip[start:start + tile_row] = pixels[row * tile_row:(row + 1) * tile_row]
+        for row in range(strip_height):
+            yield strip[row * row_size:(row + 1) * row_size]
+
+
+def _crop_rows(rows, box, bpp):
+    left, top, right, bottom = box
+    for y, row in enumerate(rows):
+        if top <= y < bottom:
+            yield row[left * bpp:right * bpp]
+
+
+def alpha_bounds(f, info):
+    """ Returns the (left, upper, right, lower) box of non transparent pixels,
+    None when no pixel is transparent or when drawable has no alpha
+    """
+    hierarchy, width, height, compression, layer_type, colormap = info
+    bpp = BYTES_PER_PIXEL[layer_type]
+    if layer_type % 2 == 0:
+        return None
+    left, top, right, bottom = width, None, 0, 0
+    for y, row in enumerate(drawable_strips(f, info)):
+        alpha = bytes(row[bpp - 1::bpp])
+        stripped = alpha.lstrip(b'\0')
+        if not stripped:
+            continue
+        if top is None:
+            top = y
+        bottom = y + 1
+        left = min(left, len(alpha) - len(stripped))
+        right = max(right, len(alpha.rstrip(b'\0')))
+    if top is None:
+        # Gimp keeps a fully transparent layer as it is
+        return None
+    box = (left, top, right, bottom)
+    return box != (0, 0, width, height) and box or None
+
+
+def _png_rows(f, info, box):
+    """ Returns (width, height, color type, palette, rows) of the png file of a drawable
+    """
+    hierarchy, width, height, compression, layer_type, colormap = info
+    rows = drawable_strips(f, info)
+    bpp = BYTES_PER_PIXEL[layer_type]
+    palette = layer_type == 4 and colormap or None
+    if layer_type == 5:
+        rows = indexed_to_rgba(rows, colormap)
+        bpp = 4
+    if box:
+        rows = _crop_rows(rows, box, bpp)
+        width, height = box[2] - box[0], box[3] - box[1]
+    return width, height, PNG_COLOR_TYPES[layer_type], palette, rows
+
+
+def export_drawable(args):
+    """ Write a layer of an xcf file, and its mask, unless their manifest entries show
+    them unchanged. Returns a list of (name, manifest entry, written, filepath)
+    """
+    xcf_path, drawables, entries, crop, png_params = args
+    with open(xcf_path, 'rb') as f:
+        h = hashlib.sha1(repr((png_params, crop)).encode('utf-8'))
+        for name, info, filepath in drawables:
+            h.update(drawable_hash(f, info).encode('ascii'))
+        layer_hash = h.hexdigest()
+        if all(e and e['hash'] == layer_hash and os.path.isfile(d[2]) and
+               os.path.getsize(d[2]) == e['size'] for d, e in zip(drawables, entries)):
+            return [(d[0], e, False, d[2]) for d, e in zip(drawables, entries)]
+
+        # A mask is cropped with its layer
+        box = crop and alpha_bounds(f, drawables[0][1]) or None
+        results = []
+        for index, (name, info, filepath) in enumerate(drawables):
+            width, height, color_type, palette, rows = _png_rows(f, info, box)
+            if index:
+                color_type = PNG_COLOR_GRAY
+            unlink_shared(filepath)
+            write_png(filepath, width, height, color_type, rows, palette, *png_params)
+            entry = OrderedDict([('hash', layer_hash), ('size', os.path.getsize(filepath))])
+            if box:
+                entry['box'] = list(box)
+            results.append((name, entry, True, filepath))
+    return results
+
+
+def _crop_layer(layer, box):
+    layer.offsets = (layer.offsets[0] + box[0], layer.offsets[1] + box[1])
+    layer.width, layer.height = box[2] - box[0], box[3] - box[1]
+
+
+def xcf_load(xcf_path, name=None):
+    """ Returns the XcfImage of an xcf file, without pixels
+    """
+    with open(xcf_path, 'rb') as f:
+        return XcfReader(f).read_image(name or os.path.basename(xcf_path))
+
+
+def xcf_prepare_layers(image, only_visible=False):
+    """ Remove hidden layers of image, as gimp_prepare_layers does
+    """
+    def visible_layers(group):
+        group.layers = [l for l in group.layers if l.visible]
+        for layer in group.layers:
+            if hasattr(layer, 'layers'):
+                visible_layers(layer)
+    if only_visible:
+        visible_layers(image)
+
+
+def xcf_export_tasks(xcf_path, image, save_path, crop_linked=False):
+    """ Write text layers of image, returns the previous manifest, entries of text
+    layers and the list of export_drawable tasks
+    """
+    if not os.path.isdir(save_path):
+        os.makedirs(save_path)
+    png_params = ((image.resolution[0], image.resolution[1]),
+                  image.parasites.get(COMMENT_PARASITE, b'').rstrip(b'\0').decode('utf-8') or None,
+                  png_profile())
+    manifest = gimp_import_manifest(save_path)
+    exported, tasks = OrderedDict(), []
+    for parent, layer in getlayers(image):
+        if hasattr(layer, 'layers'):
+            # Ignore GroupLayers
+            continue
+        filepath = os.path.join(save_path, layer.name)
+        if getattr(layer, 'text', None) is not None:
+            text = layer.text.encode('utf-8')
+            layer_hash = hashlib.sha1(text).hexdigest()
+            entry = manifest.get(layer.name)
+            if not (entry and entry['hash'] == layer_hash and os.path.isfile(filepath)):
+                print('TEXT     %s' % filepath)
+                unlink_shared(filepath)
+                with open(filepath, 'wb') as f:
+                    f.write(text)
+            exported[layer.name] = dict(hash=layer_hash, size=os.path.getsize(filepath))
+            continue
+        if isinstance(layer, XcfChannel):
+            # Exported with its layer
+            continue
+        drawables = [(layer.name, drawable_info(image, layer), filepath)]
+        if layer.mask:
+            drawables.append((layer.mask.name, drawable_info(image, layer.mask),
+                              os.path.join(save_path, layer.mask.name)))
+        tasks.append((os.path.abspath(xcf_path), drawables,
+                      [manifest.get(d[0]) for d in drawables],
+                      bool(crop_linked and layer.linked), png_params))
+    return manifest, exported, tasks
+
+
+def xcf_export_results(image, save_path, manifest, exported, results):
+    """ Crop layers of image to the boxes of results, write layout.json and the manifest,
+    remove files of layers exported previously that no longer exist
+    """
+    layers = dict((l.name, l) for p, l in getlayers(image))
+    for name, entry, written, filepath in results:
+        exported[name] = entry
+        if entry.get('box'):
+            _crop_layer(layers[name], entry['box'])
+    for name in set(manifest) - set(exported):
+        filepath = os.path.join(save_path, name)
+        if os.path.isfile(filepath):
+            print('REMOVE   %s' % filepath)
+            os.remove(filepath)
+    gimp_export_manifest(save_path, exported)
+    with open(os.path.join(save_path, JSON_LAYOUT_FILE), 'w') as f:
+        dump_layout(image, f)
+
+
+def skin_hidden_orientation(image):
+    """ Remove the rotated group that skin_rotate.py generates again from image,
+    as the Gimp skin export does. Returns True when the skin has to be rotated
+    """
+    groups = [l for l in image.layers if l.name in ORIENTATIONS and hasattr(l, 'layers')]
+    if not groups:
+        return False
+    target = [l for l in groups[1:] if l.name != groups[0].name]
+    if target and target[0].visible:
+        return False
+    if target:
+        image.layers.remove(target[0])
+    return True
+
+
+def self_test():
+    """ Check the decoders on small samples, returns the exit status
+    """
+    if not __debug__:
+        print('ERROR    self-test needs asserts, run it without -O', file=sys.stderr)
+        return 2
+    # RLE tiles: short run and short literal, then long run and long literal
+    assert _decode_rle(bytearray([3, 0x10, 252, 1, 2, 3, 4]), 4, 2) == \
+        (bytearray([0x10, 1, 0x10, 2, 0x10, 3, 0x10, 4]), 7)
+    assert _decode_rle(bytearray([127, 0, 4, 0x20, 128, 0, 4, 5, 6, 7, 8]), 4, 2) == \
+        (bytearray([0x20, 5, 0x20, 6, 0x20, 7, 0x20, 8]), 11)
+    try:
+        _decode_rle(bytearray([4, 0x10]), 4, 1)
+        assert False, 'corrupt RLE tile decoded'
+    except ValueError:
+        pass
+
+    text = b'(markup "<b>hw.lcd.density=\\"480\\"</b>\\n")\n(font "Sans")\n\0'
+    parasite = b'gimp-text-layer\0'
+    data = struct.pack('>I', len(parasite)) + parasite + struct.pack('>2I', 1, len(text)) + text
+    assert parse_parasites(data) == {TEXT_PARASITE: text}
+    assert parse_text(text) == 'hw.lcd.density="480"\n'
+    print('OK       self-test')
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export layers of xcf files without Gimp')
+    parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(),
+                        help='number of worker processes, one per core by default')
+    parser.add_argument('-o', '--output',
+                        help='export directory, xcf file path without .xcf by default')
+    parser.add_argument('--visible', action='store_true', help='export visible layers only')
+    parser.add_argument('--skin', action='store_true',
+                        help='export skins: crop linked layers, rotate, write layout')
+    parser.add_argument('--self-test', action='store_true',
+                        help='check the xcf decoders and exit')
+    parser.add_argument('xcf_files', nargs='*', metavar='image.xcf')
+    args = parser.parse_args(argv)
+
+    if args.self_test:
+        return self_test()
+    if not args.xcf_files:
+        parser.error('at least one xcf file is required')
+
+    if args.output and len(args.xcf_files) > 1:
+        parser.error('--output needs a single xcf file')
+
+    skins, tasks = [], []
+    for xcf_path in args.xcf_files:
+        save_path = os.path.normpath(args.output or os.path.splitext(xcf_path)[0])
+        try:
+            image = xcf_load(xcf_path, args.skin and SKIN_IMAGE_NAME or None)
+            xcf_prepare_layers(image, args.visible)
+            rotate = args.skin and skin_hidden_orientation(image)
+            skin_tasks = xcf_export_tasks(xcf_path, image, save_path, args.skin)
+        except (IOError, OSError, ValueError, struct.error) as e:
+            print('ERROR    %s: %s' % (xcf_path, e), file=sys.stderr)
+            return 2
+        skins.append((save_path, image, rotate) + skin_tasks[:2])
+        tasks.extend(skin_tasks[2])
+
+    # Biggest layers first, to balance workers
+    tasks.sort(key=lambda t: -t[1][0][1][1] * t[1][0][1][2])
+    results = []
+    if tasks:
+        pool = multiprocessing.Pool(max(1, min(args.jobs, len(tasks))))
+        try:
+            for layer_results in pool.imap_unordered(export_drawable, tasks):
+                for name, entry, written, filepath in layer_results:
+                    print('%s%s' % (written and 'PNG      ' or 'UNCHANGED ', filepath))
+                results.extend(layer_results)
+        except (IOError, OSError, ValueError, struct.error) as e:
+            print('ERROR    %s' % e, file=sys.stderr)
+            return 2
+        finally:
+            pool.close()
+            pool.join()
+
+    for save_path, image, rotate, manifest, exported in skins:
+        xcf_export_results(image, save_path, manifest, exported,
+                           [r for r in results if os.path.dirname(r[3]) == save_path])
+        print('JSON     %s' % os.path.join(save_path, JSON_LAYOUT_FILE))
+        if not args.skin:
+            continue
+        if rotate:
+            if skin_rotate(['-j', str(args.jobs), save_path]):
+                return 2
+            continue
+        layout_filepath = os.path.join(save_path, SKIN_LAYOUT_FILE)
+        try:
+            layout = skin_layout(skin_import_json(save_path))
+        except (ValueError, AttributeError, LayerNameError) as e:
+            print('ERROR    %s: %s' % (save_path, e), file=sys.stderr)
+            return 2
+        with open(layout_filepath, 'w') as f:
+            f.write(layout)
+        print('LAYOUT   %s' % layout_filepath)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,12 +1,105 @@
 #! /bin/sh
 
+usage() {
+    echo
+    echo "USAGE : $0 [-f] [-j workers] [-d densities] [-r ratios] <image.xcf|'glob'> [...]"
+    echo
+    echo "Exports each xcf file with a pool of Gimp batch workers, one per core by default."
+    echo "With -d \"mdpi xhdpi ...\", each density is exported to <image>_<density>/"
+    echo "With -r \"DEFAULT 4/3 ...\", each aspect ratio is exported to <image>_<density>_4x3/"
+    echo "Densities are split across workers, skins unchanged since their last export are skipped."
+    echo "With -f, skins are exported again even when unchanged."
+    echo
+    exit 1
+}
+
+WORKERS=`getconf _NPROCESSORS_ONLN 2>/dev/null || echo 1`
+
+while getopts "fj:d:r:" opt; do
+    case $opt in
+        f) XCF_FORCE=1; export XCF_FORCE ;;
+        j) WORKERS=$OPTARG ;;
+        d) XCF_DENSITIES=$OPTARG ;;
+        r) XCF_RATIOS=$OPTARG; export XCF_RATIOS ;;
+        *) usage ;;
+    esac
+done
+shift $((OPTIND - 1))
+
 if [ -z "$1" ]; then
-    echo 
-    echo "USAGE : $0 <image.xcf>"
-    echo 
-    exit 1 
+    usage
 fi
 
 scriptdir=`dirname "$0"`
+# Plugin modules are imported from gimp-plugins, the plugin itself is read from stdin
+PYTHONPATH="$scriptdir/gimp-plugins${PYTHONPATH:+:$PYTHONPATH}"
+export PYTHONPATH
+queue=`mktemp -d "${TMPDIR:-/tmp}/skin_extract.XXXXXX"`
+trap 'rm -rf "$queue"' EXIT
+
+# Expand arguments, quoted globs included, biggest files first
+for arg in "$@"; do
+    if [ -f "$arg" ]; then
+        printf '%s\n' "$arg"
+    else
+        for f in $arg; do
+            [ -f "$f" ] && printf '%s\n' "$f"
+        done
+    fi
+done | while IFS= read -r f; do
+    printf '%s\t%s\n' `wc -c < "$f"` "$f"
+done | sort -rn | cut -f2- | while IFS= read -r f; do
+    # One job per density, ratios of a density share its scaled image
+    if [ -n "$XCF_DENSITIES" ]; then
+        for d in `echo "$XCF_DENSITIES" | tr ',' ' '`; do
+            printf '%s\t%s\n' "$f" "$d"
+        done
+    elif [ -n "$XCF_RATIOS" ]; then
+        printf '%s\tDEFAULT\n' "$f"
+    else
+        printf '%s\n' "$f"
+    fi
+done > "$queue/jobs"
+
+count=`wc -l < "$queue/jobs"`
+if [ $count -eq 0 ]; then
+    echo "No xcf file found"
+    exit 1
+fi
+tab=`printf '\t'`
+if [ $WORKERS -gt $count ]; then
+    WORKERS=$count
+fi
+
+echo "Exporting $count job(s) with $WORKERS worker(s)"
+
+# Each worker loads the plugin once, then claims jobs until none is left
+i=0
+while [ $i -lt $WORKERS ]; do
+    XCF_JOBS="$queue/jobs" gimp -idf --batch-interpreter=python-fu-eval -b - -b 'pdb.gimp_quit(0)' < $scriptdir/gimp-plugins/gimp_export_skin.py &
+    i=$((i + 1))
+done
+wait
+
+# Summary
+status=0
+i=0
+echo
+while IFS="$tab" read -r xcf density; do
+    if [ -n "$density" ]; then
+        xcf="$xcf [$density]"
+    fi
+    if [ -f "$queue/$i.ok" ]; then
+        echo "OK      $xcf (`cat "$queue/$i.ok"`)"
+    elif [ -f "$queue/$i.err" ]; then
+        echo "FAILED  $xcf"
+        sed 's/^/        /' "$queue/$i.err"
+        status=2
+    else
+        echo "FAILED  $xcf (not exported, Gimp worker exited)"
+        status=2
+    fi
+    i=$((i + 1))
+done < "$queue/jobs"
 
-XCF_FILE=$1 gimp -idf --batch-interpreter=python-fu-eval -b - -b 'pdb.gimp_quit(0)' < $scriptdir/gimp-plugins/gimp_export_skin.py
+exit $status
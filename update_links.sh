@@ -1,5 +1,6 @@
 #!/bin/bash
 
+scriptdir=`dirname "$0"`
 SDK_DIR=`echo $PATH | grep -i --color=never -o "[^:]*android[^:]*sdk[^:]*/tools[^:]*"`
 OIFS=$IFS
 IFS=$'\n'
@@ -15,23 +16,8 @@ else
     echo "Using Android SDK directory: \"$SDK_DIR\""
 fi
 
-# Update links
-for android_skin_dir in $(find ${SDK_DIR}/platforms/android-* -type d -name skins); do
-    # Remove links
-    for eskin_link in $(find ${android_skin_dir} -type l -iname "ESKIN_*" ); do
-        echo "remove link: ${eskin_link}"
-        rm "${eskin_link}"
-    done
-    
-    # Create links
-    for eskin_dir in $(find . -type d -iname "ESKIN_*" ); do
-        skindir="$(basename ${eskin_dir})"
-        target="$PWD/$skindir"
-        link="${android_skin_dir}/$skindir"
-        echo "create link: $target  ->  $link"
-        ln -s "$target" "$link"
-    done
-done
+# Update links of all platforms, from the skin catalog indexed once
+"$scriptdir/gimp-plugins/skin_catalog.py" link "${SDK_DIR}"/platforms/android-*/skins
 
 IFS=$OIFS
 